@@ -1,11 +1,14 @@
 from random import Random
 from typing import Tuple, Set, Dict
 
+import numpy as np
+
 from simulation.simulation_state import SimulationState
 
 
 class StateAgent:
     """Base class for a model agent."""
+    __slots__ = ('unique_id', 'pos', 'random_seed')
 
     def __init__(self, unique_id: int, pos: Tuple[int, int], random_seed: Random) -> None:
         self.unique_id = unique_id
@@ -24,20 +27,20 @@ class StateAgent:
 
 
 class Obstacle(StateAgent):
-
-    def __init__(self, uid: int, pos: Tuple[int, int], random_seed: Random) -> None:
-        super().__init__(uid, pos, random_seed)
+    """Breed of obstacle cells. Obstacles are static, they are stored only in the grid layer (see place_static)."""
+    __slots__ = ()
 
 
 class Exit(StateAgent):
-
-    def __init__(self, uid: int, pos: Tuple[int, int], random_seed: Random, exit_area_id: int) -> None:
-        super().__init__(uid, pos, random_seed)
-
-        self.area_id = exit_area_id
+    """Breed of exit cells, stored only in the grid layer and exit areas of the grid (see init_exit_areas)."""
+    __slots__ = ()
 
 
 class Sensor(StateAgent):
+    __slots__ = ('sensor_area_id', 'sensing_positions', 'sensing_indices', 'evacuees_in_area', 'evacuees_count')
+
+    # Debug mode, compares incrementally maintained count with full recount on every step
+    verify_count = False
 
     def __init__(self, uid: int, pos: Tuple[int, int], random_seed: Random, sensor_area_id: int,
                  sensing_positions: Set[Tuple[int, int]]) -> None:
@@ -45,22 +48,25 @@ class Sensor(StateAgent):
 
         self.sensor_area_id = sensor_area_id
         self.sensing_positions = sensing_positions
+        self.sensing_indices = tuple(np.array(list(sensing_positions), dtype=np.intp).reshape(-1, 2).T)  # (xs, ys)
         self.evacuees_in_area = None
+        self.evacuees_count = 0  # live number of occupied cells in area, updated by the grid on evacuees moves
 
     def step(self, state: SimulationState) -> None:
-        self.evacuees_in_area = len(self.sensing_positions.intersection(state.grid.positions_by_breed[Evacuee]))
+        if self.verify_count:
+            recount = self.count_evacuees(state)
+            if recount != self.evacuees_count:
+                raise AssertionError(f"Sensor {self.unique_id} counted {self.evacuees_count} evacuees, "
+                                     f"recount gives {recount}")
 
+        self.evacuees_in_area = self.evacuees_count
 
-class MapInfo(StateAgent):
-
-    def __init__(self, uid: int, pos: Tuple[int, int], value: int, color: str, random_seed: Random) -> None:
-        super().__init__(uid, pos, random_seed)
-
-        self.value = value
-        self.color = color
+    def count_evacuees(self, state: SimulationState) -> int:
+        return int(np.count_nonzero(state.grid.layers[Evacuee][self.sensing_indices]))
 
 
 class GuideAgent(StateAgent):
+    # Without __slots__: guides are few and StepProfiler wraps methods of their instances
 
     def __init__(self, uid: int, pos: Tuple[int, int], random_seed: Random) -> None:
         super().__init__(uid, pos, random_seed)
@@ -84,6 +90,7 @@ class GuideAgent(StateAgent):
 
 
 class Evacuee(StateAgent):
+    __slots__ = ('assigned_exit_area_id',)
 
     def __init__(self, uid: int, pos: Tuple[int, int], random_seed: Random) -> None:
         super().__init__(uid, pos, random_seed)
@@ -93,17 +100,18 @@ class Evacuee(StateAgent):
         if self.assigned_exit_area_id is None:
             return "MM"
 
-        pos = state.schedule.agents_by_breed[type(self)][self.unique_id].pos
-        ghost_agents = state.ghost_agents
-
-        legal_actions_with_positions = state.grid.get_legal_actions_with_positions(pos, ghost_agents)
-
-        if legal_actions_with_positions == {}:
-            return "MM"
+        x, y = state.schedule.agents_by_breed[type(self)][self.unique_id].pos
+        area_map = state.exit_maps[self.assigned_exit_area_id]
 
-        legal_actions_with_distances = self.get_distance_for_positions(state, legal_actions_with_positions)
+        # first of the closest moves wins, same as min() over actions in action_position_map order
+        best_action = "MM"
+        best_distance = None
+        for action, x_mod, y_mod in state.grid.get_legal_moves((x, y), state.ghost_agents):
+            distance = area_map[x + x_mod, y + y_mod]
 
-        best_action = min(legal_actions_with_distances, key=legal_actions_with_distances.get)
+            if best_distance is None or distance < best_distance:
+                best_action = action
+                best_distance = distance
 
         return best_action
 
@@ -1,16 +1,27 @@
 import random
-from collections import defaultdict
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Union
+
+import numpy as np
 
 from agents.agents import GuideAgent, Exit
-from agents.feature_extractor import FeatureExtractor
+from agents.feature_extractor import FeatureExtractor, FEATURES
 from simulation.simulation_state import SimulationState
 
 
+def weights_from_dict(weights: Dict) -> np.ndarray:
+    """Converts weights in JSON format {feature name: weight} into vector ordered as FEATURES. Missing weights are 0 and
+    weights of features, which are not extracted anymore, are dropped."""
+    return np.array([float(weights.get(k, 0.0)) for k in FEATURES])
+
+
+def weights_to_dict(weights: np.ndarray) -> Dict:
+    return {k: float(v) for k, v in zip(FEATURES, weights)}
+
+
 class GuideQLearning(GuideAgent):
     def __init__(self, uid: int, pos: Tuple[int, int], random_seed: random.Random, epsilon: float = 0.0,
                  gamma: float = 0.8, alpha: float = 0.2, extractor: FeatureExtractor = None,
-                 weights: Dict = None) -> None:
+                 weights: Union[np.ndarray, Dict] = None) -> None:
 
         super().__init__(uid, pos, random_seed)
         self.lifepoints = 100
@@ -25,8 +36,11 @@ class GuideQLearning(GuideAgent):
         if extractor is None:
             self.extractor = FeatureExtractor(self.unique_id)
 
+        # Weights vector is updated in place, guides created with the same array learn together
         if weights is None:
-            self.weights = defaultdict(lambda: 0.0)
+            self.weights = np.zeros(len(FEATURES))
+        elif isinstance(weights, dict):
+            self.weights = weights_from_dict(weights)
 
     def step(self, state: SimulationState) -> str:
         # Move section
@@ -49,32 +63,28 @@ class GuideQLearning(GuideAgent):
         return action_to_take
 
     def compute_action_from_q_values(self, state: SimulationState, legal_actions: List[str]) -> str:
-        actions = []
-        for action in legal_actions:
-            actions.append((action, self.get_q_value(state, action)))
+        q_values = self.get_q_values(state, legal_actions)
 
-        best_action = max(actions, key=lambda x: x[1])
-        return best_action[0]
+        return legal_actions[int(np.argmax(q_values))]  # first of the best ones
 
-    def get_q_value(self, state: SimulationState, action: str) -> float:
-        feats = self.extractor.get_features(state, action)
+    def get_q_values(self, state: SimulationState, actions: List[str]) -> np.ndarray:
+        feats_matrix = self.extractor.get_features_matrix(state, actions)
 
-        return self.get_q_value_feats(feats)
+        # row sums add products in features order, so values are the same as summed one by one
+        return (feats_matrix * self.weights).sum(axis=1)
 
-    def get_q_value_feats(self, feats: Dict) -> float:
-        q_val = 0
+    def get_q_value(self, state: SimulationState, action: str) -> float:
+        return self.get_q_values(state, [action])[0]
 
-        for k in feats.keys():
-            q_val += feats[k] * self.weights[k]
-        return q_val
+    def get_q_value_feats(self, feats: Dict) -> float:
+        return (FeatureExtractor.features_to_vector(feats) * self.weights).sum()
 
     def update(self, feats_action: Dict, next_state: SimulationState, reward: int) -> None:
         max_Q_sa_prim = self.compute_value_from_q_values(next_state)
         Q_sa = self.get_q_value_feats(feats_action)
         diff = reward + (self.gamma * max_Q_sa_prim) - Q_sa
 
-        for k in feats_action.keys():
-            self.weights[k] = self.weights[k] + (self.alpha * diff * feats_action[k])
+        self.weights += self.alpha * diff * FeatureExtractor.features_to_vector(feats_action)
 
         self.extractor.update_extractor(feats_action, next_state)
         self.lifepoints += reward
@@ -90,11 +100,7 @@ class GuideQLearning(GuideAgent):
         if not legal_actions:
             return 0.0
 
-        values = []
-        for action in legal_actions:
-            values.append(self.get_q_value(state, action))
-
-        return max(values)
+        return self.get_q_values(state, legal_actions).max()
 
     def get_exit(self, state: SimulationState) -> int:
         return self.get_closest_exit(state)[0]
@@ -109,7 +115,7 @@ class GuideQLearning(GuideAgent):
     def get_value(self, state) -> float:
         return self.compute_value_from_q_values(state)
 
-    def get_weights(self) -> Dict:
+    def get_weights(self) -> np.ndarray:
         return self.weights
 
     def on_remove(self, state: SimulationState) -> Dict:
@@ -1,98 +1,462 @@
+import hashlib
 import math
+import os
 import sys
-from collections import defaultdict
+import threading
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
 
 import multiprocess
 import numpy as np
-from multiprocess.context import Process
+from multiprocess import shared_memory
 
-from agents.agents import GuideAgent, Evacuee, Sensor
+from agents.agents import GuideAgent, Sensor
+from simulation.distance_field import square_rounded_maps, square_rounded_distances
 from simulation.grid import EvacuationGrid
 from simulation.simulation_state import SimulationState
 
 
-def get_distance_maps(positions_chunk, grid, queue):
-    chunk_maps = dict()
-    chunk_maps_lists = dict()
-    for pos in positions_chunk:
-        area_map, _ = grid.generate_square_rounded_map(pos, {pos})
-        chunk_maps[pos] = area_map
+MAPS_CACHE_DIR = "cache"
+MAPS_CACHE_VERSION = 1
+MAPS_CACHE_MAX_BYTES = 2 ** 33  # least recently used files are removed when the cache directory is bigger
+MAPS_BATCH_SIZE = 64
 
-        # TODO: Version List (position = [positions sorted by distance value])
 
-        # lst = []
-        # for x in range(area_map.shape[0]):
-        #     for y in range(area_map.shape[1]):
-        #         lst.append((x, y, area_map[x][y]))
-        #
-        # # lst.remove(pos)
-        # lst.sort(key=lambda i: i[2])
-        # # chunk_maps_lists[pos] = [(x[0], x[1]) for x in lst]
-        # chunk_maps_lists[pos] = lst
+def get_maps_cache_key(obstacles_mask: np.ndarray) -> str:
+    key = hashlib.sha1(f"v{MAPS_CACHE_VERSION}:{obstacles_mask.shape}".encode())
+    key.update(np.packbits(obstacles_mask).tobytes())
 
-        # TODO: Version Dict({position:{distance_value:[list_of_positions]}})
+    return key.hexdigest()
 
-        # chunk_maps_lists[pos] = dict()
-        # for val in np.unique(area_map):
-        #     results = np.where(area_map == val)
-        #     chunk_maps_lists[pos][val] = set(zip(results[0], results[1]))
 
-        # print(list(zip(results[0],results[1])), v)
-        # print(area_map)
-        # input()
-    print("Process finished")
+def prune_maps_cache(cache_dir: str, keep_path: str, max_bytes: int = MAPS_CACHE_MAX_BYTES) -> None:
+    """Removes the least recently used (by modification time, touched on every load) maps files of cache directory
+    until it fits in max_bytes, except keep_path. Files removed or in use by other processes are skipped."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if not name.endswith(".npy") or not name.startswith(("maps_", "landmarks_")):
+            continue
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
 
-    # queue.put({'msg': 'lists', 'content': chunk_maps_lists})
-    queue.put({'msg': 'maps', 'content': chunk_maps})
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep_path:
+            continue
+        try:
+            os.remove(path)  # mapped file stays readable by processes which have it open
+            total -= size
+        except OSError:
+            pass
 
 
-def get_feature_extractor_maps(grid, n_jobs=-1):
+def touch_cache_file(cache_path: str) -> None:
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+
+
+def get_maps_dtype(width: int, height: int) -> np.dtype:
+    # route can not be longer than number of cells
+    return np.min_scalar_type(width * height)
+
+
+def get_n_jobs(n_jobs: int) -> int:
+    # Same convention as joblib: -1 means all CPUs, -2 all but one etc.
+    if n_jobs == 0:
+        raise ValueError("n_jobs can not be 0")
+
+    if n_jobs < 0:
+        n_jobs = max(multiprocess.cpu_count() + 1 + n_jobs, 1)
+
+    return n_jobs
+
+
+def write_distance_maps(maps, positions, open_mask):
+    for i in range(0, len(positions), MAPS_BATCH_SIZE):
+        batch = positions[i:i + MAPS_BATCH_SIZE]
+        area_maps, _ = square_rounded_maps(open_mask, batch)
+
+        xs, ys = np.array(batch).T
+        maps[xs, ys] = area_maps
+
+
+def get_distance_maps(positions_chunk, open_mask, maps_buffer):
+    """Worker function, writes maps of positions_chunk straight into shared memory described by maps_buffer (name,
+    shape, dtype) instead of sending them back to the parent process."""
+    shm_name, shape, dtype = maps_buffer
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    try:
+        maps = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        write_distance_maps(maps, positions_chunk, open_mask)
+        del maps  # buffer can not be closed while array is still using it
+    finally:
+        shm.close()
+
+
+def compute_feature_extractor_maps(maps, open_mask, n_jobs=-1):
+    width, height = open_mask.shape
+    all_positions = EvacuationGrid.area_positions_from_points((0, 0), (width - 1, height - 1))
+
+    # small chunks keep all workers busy until the end
+    chunks = [all_positions[i:i + MAPS_BATCH_SIZE] for i in range(0, len(all_positions), MAPS_BATCH_SIZE)]
+    n_jobs = min(get_n_jobs(n_jobs), len(chunks))
+
+    if n_jobs == 1:
+        write_distance_maps(maps, all_positions, open_mask)
+        return
+
+    shm = shared_memory.SharedMemory(create=True, size=maps.nbytes)
+    try:
+        maps_buffer = (shm.name, maps.shape, maps.dtype)
+
+        # Worker exceptions are re-raised by starmap, leaving the with block terminates remaining workers
+        with multiprocess.Pool(n_jobs) as pool:
+            pool.starmap(get_distance_maps, [(chunk, open_mask, maps_buffer) for chunk in chunks], chunksize=1)
+            pool.close()
+            pool.join()
+
+        shared_maps = np.ndarray(maps.shape, dtype=maps.dtype, buffer=shm.buf)
+        maps[...] = shared_maps
+        del shared_maps
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def get_feature_extractor_maps(grid, n_jobs=-1, cache_dir=MAPS_CACHE_DIR):
+    """Returns read-only array of shape (width, height, width, height), where maps[x, y] (or maps[pos]) is distance map
+    from position (x, y). Maps are memory-mapped from cache file, so processes using the same map share one copy."""
     width = grid.width
     height = grid.height
 
-    if n_jobs == -1:
-        n_threads = 16
+    obstacles_mask = grid.get_obstacles_mask()
+    shape = (width, height, width, height)
+    dtype = get_maps_dtype(width, height)
 
-    all_positions = EvacuationGrid.area_positions_from_points((0, 0), (width - 1, height - 1))
+    if cache_dir is None:
+        maps = np.empty(shape, dtype=dtype)
+        compute_feature_extractor_maps(maps, ~obstacles_mask, n_jobs)
+        return maps, dict()
 
-    chunks = []
-    step = math.ceil(len(all_positions) / n_threads)
-    for i in range(0, len(all_positions), step):
-        chunks.append(all_positions[i:i + step])
+    cache_path = os.path.join(cache_dir, f"maps_{get_maps_cache_key(obstacles_mask)}.npy")
 
-    global get_distance_maps
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
 
-    queue = multiprocess.Queue(maxsize=100)
-    # processes = []
-    for chunk in chunks:
-        p = Process(target=get_distance_maps, args=(chunk, grid, queue,)).start()
-        # processes.append(p)
+        maps = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=shape)
+        compute_feature_extractor_maps(maps, ~obstacles_mask, n_jobs)
+        maps.flush()
+        del maps
 
-    maps = dict()
-    maps_lists = dict()
+        os.replace(tmp_path, cache_path)  # atomic, other processes never see partial file
+        prune_maps_cache(cache_dir, cache_path)
+    else:
+        touch_cache_file(cache_path)
 
-    for _ in range(n_threads):
-        item = queue.get()
+    # plain ndarray view, np.memmap subclass makes every element access slow
+    return np.asarray(np.load(cache_path, mmap_mode="r")), dict()
 
-        if item['msg'] == 'lists':
-            maps_lists.update(item['content'])
-        else:
-            maps.update(item['content'])
-    # for p in processes:
-    #     p.join()
 
-    return maps, maps_lists
+def get_landmark_distances(grid, n_landmarks: int, cache_dir=MAPS_CACHE_DIR) -> 'LandmarkDistances':
+    """Returns LandmarkDistances with n_landmarks distance maps, they are cached like extractor maps."""
+    open_mask = ~grid.get_obstacles_mask()
+
+    if cache_dir is None:
+        return LandmarkDistances(open_mask, compute_landmark_maps(open_mask, n_landmarks))
+
+    cache_path = os.path.join(cache_dir, f"landmarks_{n_landmarks}_{get_maps_cache_key(~open_mask)}.npy")
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+
+        with open(tmp_path, "wb") as f:
+            np.save(f, compute_landmark_maps(open_mask, n_landmarks))
+        os.replace(tmp_path, cache_path)
+        prune_maps_cache(cache_dir, cache_path)
+    else:
+        touch_cache_file(cache_path)
+
+    return LandmarkDistances(open_mask, np.load(cache_path))
+
+
+def compute_landmark_maps(open_mask: np.ndarray, n_landmarks: int) -> np.ndarray:
+    """Distance maps of landmarks chosen by farthest point sampling: every next landmark is the reachable cell farthest
+    from the landmarks chosen so far, starting from the cell farthest from the first open cell."""
+    width, height = open_mask.shape
+    seed_map, unreachable = square_rounded_maps(open_mask, [tuple(np.argwhere(open_mask)[0])])
+    reachable = open_mask & ~unreachable[0]
+
+    maps = np.empty((n_landmarks, width, height), dtype=get_maps_dtype(width, height))
+    closest = np.where(reachable, seed_map[0], -1)  # distance to the closest landmark
+    for i in range(n_landmarks):
+        landmark = np.unravel_index(np.argmax(closest), closest.shape)
+        landmark_map, _ = square_rounded_maps(open_mask, [landmark])
+        maps[i] = landmark_map[0]
+
+        closest = np.minimum(closest, landmark_map[0]) if i > 0 else np.where(reachable, landmark_map[0], -1)
+
+    return maps
+
+
+class LandmarkMap:
+    """Distance map from one cell estimated by LandmarkDistances, values are computed only for asked cells."""
+
+    def __init__(self, landmarks: 'LandmarkDistances', pos) -> None:
+        self.landmarks = landmarks
+        self.values = landmarks.maps[(slice(None),) + tuple(pos)].astype(int)
+
+    def __getitem__(self, pos) -> int:
+        return int(np.abs(self.landmarks.maps[(slice(None),) + tuple(pos)] - self.values).max())
+
+    def max(self) -> int:
+        # Route to the end of the longest landmark route is at least its length minus route between landmark and cell
+        return int(np.maximum(self.values, self.landmarks.max_route_lens - self.values).max())
+
+
+class LandmarkDistances:
+    """Replacement of all pairs extractor maps for maps too big to compute them, memory is O(cells * landmarks).
+    Distance between cells is estimated by the triangle inequality over distance maps of landmarks (ALT bound), more
+    landmarks give tighter estimates. maps[pos] gives LandmarkMap instead of full map, distance to the closest
+    unvisited cell is computed exactly by LocalUnvisitedIndex."""
+
+    def __init__(self, open_mask: np.ndarray, maps: np.ndarray) -> None:
+        self.open_mask = open_mask
+        self.maps = maps
+        self.max_route_lens = maps.reshape(len(maps), -1).max(axis=1).astype(int)
+
+    def __getitem__(self, pos) -> LandmarkMap:
+        return LandmarkMap(self, pos)
+
+
+class LazyDistanceMaps:
+    """Extractor maps computed on first use of maps[pos] instead of all at once, the same values as
+    get_feature_extractor_maps gives. Computed maps are kept in LRU cache limited to max_bytes. With prefetch, maps
+    asked for by prefetch() are computed in background thread, asking for a map being prefetched waits for it.
+    Distance to the closest unvisited cell is searched by LocalUnvisitedIndex, which doesn't need all maps."""
+
+    def __init__(self, open_mask: np.ndarray, max_bytes: int = 2 ** 28, prefetch: bool = False) -> None:
+        self.open_mask = open_mask
+        self.dtype = get_maps_dtype(*open_mask.shape)
+        self.max_maps = max(max_bytes // (open_mask.size * np.dtype(self.dtype).itemsize), 1)
+
+        self.cache = OrderedDict()  # pos: map, the least recently used first
+        self.pending = dict()  # pos: future of prefetched batch
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.evicted = 0
+
+    def __deepcopy__(self, memo) -> 'LazyDistanceMaps':
+        # Read-only cache shared by all states, its lock and prefetch thread can't be copied
+        return self
+
+    def __getitem__(self, pos) -> np.ndarray:
+        pos = tuple(pos)
+        with self.lock:
+            area_map = self.cache.get(pos)
+            future = self.pending.get(pos)
+            if area_map is not None:
+                self.cache.move_to_end(pos)
+            if area_map is not None or future is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if area_map is not None:
+            return area_map
+        if future is not None:
+            if future.exception() is None:
+                return future.result()[pos]
+
+            # Failed prefetch is dropped, the map is computed again here
+            with self.lock:
+                if self.pending.get(pos) is future:
+                    del self.pending[pos]
+
+        area_map = self.compute([pos])[pos]
+        with self.lock:
+            self.store(pos, area_map)
+
+        return area_map
+
+    def compute(self, positions) -> Dict:
+        area_maps, _ = square_rounded_maps(self.open_mask, positions)
+        area_maps = area_maps.astype(self.dtype)
+        area_maps.flags.writeable = False  # shared by all users, like memory-mapped maps
+
+        return dict(zip(positions, area_maps))
+
+    def store(self, pos, area_map: np.ndarray) -> None:
+        self.cache[pos] = area_map
+        while len(self.cache) > self.max_maps:
+            self.cache.popitem(last=False)
+            self.evicted += 1
+
+    def prefetch(self, positions) -> None:
+        """Starts computing maps of positions, which are not cached yet, in background. Does nothing without
+        prefetch."""
+        if self.executor is None:
+            return
+
+        with self.lock:
+            positions = [pos for pos in map(tuple, positions) if pos not in self.cache and pos not in self.pending]
+            if not positions:
+                return
+
+            future = self.executor.submit(self.compute_prefetched, positions)
+            for pos in positions:
+                self.pending[pos] = future
+
+    def prefetch_around(self, pos, radius: int) -> None:
+        """Prefetches maps of open cells at most radius moves from pos."""
+        x, y = pos
+        window = self.open_mask[max(x - radius, 0):x + radius + 1, max(y - radius, 0):y + radius + 1]
+
+        self.prefetch([(max(x - radius, 0) + i, max(y - radius, 0) + j) for i, j in np.argwhere(window).tolist()])
+
+    def compute_prefetched(self, positions) -> Dict:
+        area_maps = dict()
+        try:
+            area_maps = self.compute(positions)
+        finally:
+            # Positions stop being pending even if computation failed, so their maps can be computed again
+            with self.lock:
+                for pos in positions:
+                    if pos in area_maps:
+                        self.store(pos, area_maps[pos])
+                    self.pending.pop(pos, None)
+                self.prefetched += len(area_maps)
+
+        return area_maps
+
+    def get_stats(self) -> Dict:
+        return {"hits": self.hits, "misses": self.misses, "prefetched": self.prefetched, "evicted": self.evicted,
+                "cached": len(self.cache), "max_maps": self.max_maps}
+
+
+class UnvisitedIndex:
+    """Keeps unvisited cells and distance from every cell to its closest unvisited cell. Distance maps are not
+    symmetric, so value of a cell is taken from its own map. It is recomputed lazily, only if one of the cells it was
+    measured to could have been visited."""
+
+    def __init__(self, maps, width: int, height: int) -> None:
+        self.maps = maps
+        self.unvisited = np.ones((width, height), dtype=bool)
+        self.distances = np.zeros((width, height), dtype=np.int64)
+        self.stale = np.ones((width, height), dtype=bool)
+        self.version = 0  # bumped whenever some cell gets visited
+
+    def visit(self, positions) -> None:
+        positions = [pos for pos in positions if self.unvisited[pos]]
+        if not positions:
+            return
+
+        xs, ys = np.array(positions).T
+        self.unvisited[xs, ys] = False
+        self.version += 1
+
+        # cells, for which one of the visited positions was the closest one
+        self.stale |= np.any(self.maps[:, :, xs, ys] == self.distances[..., None], axis=-1)
+
+    def get_distance(self, pos) -> int:
+        if self.stale[pos]:
+            if self.unvisited.any():
+                self.distances[pos] = self.maps[pos][self.unvisited].min()
+            else:
+                self.distances[pos] = np.iinfo(self.distances.dtype).max
+
+            self.stale[pos] = False
+
+        return self.distances[pos]
+
+
+class LocalUnvisitedIndex(UnvisitedIndex):
+    """UnvisitedIndex for maps without all pairs array (LandmarkDistances, LazyDistanceMaps). Distance to the closest
+    unvisited cell is searched only around the cell, in window growing until the found route is not longer than window
+    radius (longer routes could leave it), so cost depends on that distance, not on grid size. Found distances are kept
+    until some cell gets visited."""
+
+    def __init__(self, maps, width: int, height: int) -> None:
+        super().__init__(maps, width, height)
+        self.found = dict()
+
+    def visit(self, positions) -> None:
+        positions = [pos for pos in positions if self.unvisited[pos]]
+        if not positions:
+            return
+
+        xs, ys = np.array(positions).T
+        self.unvisited[xs, ys] = False
+        self.version += 1
+        self.found.clear()
+
+    def get_distance(self, pos) -> int:
+        distance = self.found.get(pos)
+        if distance is None:
+            distance = self.search(pos)
+            self.found[pos] = distance
+
+        return distance
+
+    def search(self, pos) -> int:
+        x, y = pos
+        width, height = self.unvisited.shape
+
+        radius = 4
+        while True:
+            x0, y0 = max(x - radius, 0), max(y - radius, 0)
+            x1, y1 = min(x + radius + 1, width), min(y + radius + 1, height)
+            whole_grid = x0 == 0 and y0 == 0 and x1 == width and y1 == height
+
+            distances = square_rounded_distances(self.maps.open_mask[x0:x1, y0:y1], [(x - x0, y - y0)])[0]
+            reached = distances[(distances >= 0) & self.unvisited[x0:x1, y0:y1]]
+            if len(reached) > 0 and (reached.min() <= radius or whole_grid):
+                return int(reached.min())
+            if whole_grid:
+                return np.iinfo(self.distances.dtype).max
+
+            radius *= 2
+
+
+def get_unvisited_index(maps, width: int, height: int) -> UnvisitedIndex:
+    if isinstance(maps, (LandmarkDistances, LazyDistanceMaps)):
+        return LocalUnvisitedIndex(maps, width, height)
+
+    return UnvisitedIndex(maps, width, height)
+
+
+# Order of features in feature vectors and Q Learning weights vector
+FEATURES = ('bias', 'newly_informed_evacuees', 'uninformed_evacuees', 'closest_exit_distance', 'closest_guide_distance',
+            'closest_unvisited_position')
 
 
 class FeatureExtractor:
     informed_evacuees = 0
     maps = dict()
     maps_lists = dict()
-    unvisited_positions = set()
+    unvisited = None
 
     def __init__(self, guide_id):
         self.guide_id = guide_id
 
+        # Features computed for positions since the last change of the world, see get_features
+        self.features_cache = dict()
+        self.features_cache_key = None
+
     def get_guide_obj(self, state: SimulationState):
         return state.schedule.get_agent_by_id(self.guide_id)
 
@@ -105,6 +469,28 @@ class FeatureExtractor:
         else:
             pos = pos
 
+        # Features depend only on position and world state, which can't change without bumping one of these counters
+        cache_key = (state.world_version, FeatureExtractor.informed_evacuees, FeatureExtractor.unvisited.version)
+        if cache_key != self.features_cache_key:
+            self.features_cache_key = cache_key
+            self.features_cache.clear()
+
+        features = self.features_cache.get(pos)
+        if features is None:
+            features = self.compute_features(state, pos)
+            self.features_cache[pos] = features
+
+        return dict(features)
+
+    def get_features_matrix(self, state: SimulationState, actions: List[str]) -> np.ndarray:
+        """Returns features of every action as rows of matrix, columns are ordered as FEATURES."""
+        return np.array([FeatureExtractor.features_to_vector(self.get_features(state, action)) for action in actions])
+
+    @staticmethod
+    def features_to_vector(features: Dict) -> np.ndarray:
+        return np.array([features[k] for k in FEATURES])
+
+    def compute_features(self, state: SimulationState, pos):
         # closest sensor
         closest_sensor, closest_sensor_distance = FeatureExtractor.get_closest_sensor(state, pos, normalize=True)
 
@@ -117,7 +503,9 @@ class FeatureExtractor:
 
         # closest other guide
         area_map = FeatureExtractor.maps[pos]
-        max_area_route_len = np.amax(area_map)
+        if isinstance(area_map, np.ndarray):
+            area_map = area_map.astype(int)  # maps are stored unsigned, avoid wrap around on subtraction
+        max_area_route_len = area_map.max()
 
         closest_guide, closest_guide_distance = self.get_closest_guide(state, pos, area_map, max_area_route_len,
                                                                        normalize=True)
@@ -150,11 +538,7 @@ class FeatureExtractor:
 
     @staticmethod
     def get_newly_informed_evacuees(state: SimulationState, pos, normalize=True, update_variables=False):
-        newly_informed_evacuees = 0
-
-        for n in state.grid.get_neighbors(pos, True, include_center=False):
-            if type(n) == Evacuee and n.assigned_exit_area_id is None:
-                newly_informed_evacuees += 1
+        newly_informed_evacuees = state.grid.count_uninformed_evacuees(pos)
 
         uninformed_evacuees = state.evacuees_num - (FeatureExtractor.informed_evacuees + newly_informed_evacuees)
 
@@ -227,7 +611,7 @@ class FeatureExtractor:
 
     def get_closest_guide(self, state, pos, area_map, max_area_route_len, normalize=True):
         g_x, g_y = pos
-        guide_map_val = area_map[g_x][g_y]
+        guide_map_val = area_map[g_x, g_y]
 
         closest_guide = None
         closest_guide_distance = max_area_route_len
@@ -238,7 +622,7 @@ class FeatureExtractor:
                         continue
 
                     x, y = agent.pos
-                    dst = abs(guide_map_val - area_map[x][y])
+                    dst = abs(guide_map_val - area_map[x, y])
 
                     if dst <= closest_guide_distance:
                         closest_guide_distance = dst
@@ -251,22 +635,7 @@ class FeatureExtractor:
 
     @staticmethod
     def get_closest_unvisited_position(state, pos, max_area_route_len, normalize=True):
-        g_x, g_y = pos
-        area_map = FeatureExtractor.maps[pos]
-        guide_map_val = area_map[g_x][g_y]
-
-        # unvisited_positions = FeatureExtractor.unvisited_positions - set(
-        #     state.grid.get_neighborhood(pos, True, include_center=True))
-
-        unvisited_positions = FeatureExtractor.unvisited_positions
-
-        closest_unvisited_position_distance = max_area_route_len
-
-        for x, y in unvisited_positions:
-            dist = abs(guide_map_val - area_map[x][y])
-
-            if dist < closest_unvisited_position_distance:
-                closest_unvisited_position_distance = dist
+        closest_unvisited_position_distance = min(FeatureExtractor.unvisited.get_distance(pos), max_area_route_len)
 
         if normalize:
             closest_unvisited_position_distance = FeatureExtractor.normalize(closest_unvisited_position_distance,
@@ -287,7 +656,11 @@ class FeatureExtractor:
         last_pos = (x * -1, y * -1)
         visited_positions = next_state.grid.get_neighborhood(last_pos, True, include_center=True)
 
-        FeatureExtractor.unvisited_positions -= set(visited_positions)
+        FeatureExtractor.unvisited.visit(visited_positions)
+
+        # Next moves of the guide will need maps of cells around it
+        if isinstance(FeatureExtractor.maps, LazyDistanceMaps):
+            FeatureExtractor.maps.prefetch_around(guide.pos, radius=2)
         # for pos in visited_positions:
         #     FeatureExtractor.maps_lists[last_pos].remove(pos)
 
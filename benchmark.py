@@ -0,0 +1,262 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from agents.agents import Exit
+from agents.agents_guides import GuideQLearning
+from agents.feature_extractor import FeatureExtractor, get_feature_extractor_maps, get_maps_dtype, \
+    get_landmark_distances
+from simulation.lean_model import LeanEvacuationModel
+from simulation.model import EvacuationModel
+from simulation.world import EvacuationWorld
+
+SEED = 0
+REPEATS = 3
+STEPS_MEASURED = 5  # scheduler steps timed one by one in every repeat
+STEPS_BEFORE_FEATURES = 5  # steps done before features are measured, so some evacuees are already informed
+INFORMED_EVACUEES_STEP = 2  # every second evacuee gets its closest exit before scheduler steps are measured
+MAX_MAPS_BYTES = 2 ** 30  # bigger all-pairs extractor maps are not built, models of such sizes use landmarks instead
+LANDMARKS = 8  # landmarks of get_landmark_distances benchmark and of models too big for all-pairs maps
+
+MAP_TYPES = ['default', 'cross', 'boxes', 'random_rectangles']
+GRID_SIZES = [50, 100, 150, 200, 300, 400]
+EVACUEES_NUMS = [100, 1000, 5000, 10000, 20000]
+EVACUEES_GRID_SIZE = 150  # evacuees scaling runs on this grid, the largest number has to fit in it
+
+QUICK_GRID_SIZES = [30, 50]
+QUICK_EVACUEES_NUMS = [100, 1000]
+QUICK_EVACUEES_GRID_SIZE = 50
+
+ENGINES = {'mesa': EvacuationModel, 'lean': LeanEvacuationModel}
+
+
+def get_model_params(size: int, evacuees_num: int, map_type: str = 'default') -> Dict:
+    # Obstacles are scaled with grid, the same proportions as 100x100 map of main_no_graphics.py
+    return {
+        "width": size, "height": size, "ghost_agents": False, "show_map": False,
+        "guides_num": 2, "guides_mode": "Q Learning", "guides_random_position": False,
+        "evacuees_num": evacuees_num, "evacuees_share_information": True, "evacuees_batched_moves": False,
+        "map_type": map_type,
+        "cross_gap": max(size // 10, 1), "boxes_thickness": max(size * 3 // 20, 1), "rectangles_num": 10,
+        "rectangles_max_size": max(size * 3 // 20, 2), "erosion_proba": 0.5,
+        "qlearning_params": {'epsilon': 0.8, 'gamma': 0.8, 'alpha': 0.2, 'weights': None},
+        "extractor_maps": None,
+    }
+
+
+def get_maps_bytes(size: int) -> int:
+    return size ** 4 * np.dtype(get_maps_dtype(size, size)).itemsize
+
+
+def new_model(model_class, model_params: Dict):
+    random.seed(SEED)
+    np.random.seed(SEED)
+    FeatureExtractor.informed_evacuees = 0
+
+    model = model_class(**model_params)
+    model.reset_randomizer(SEED)
+    return model
+
+
+def inform_evacuees(model, every: int = INFORMED_EVACUEES_STEP) -> None:
+    """Assigns the closest exit to every n-th evacuee, so measured steps move and order them and they inform the
+    others, instead of the first steps of a new model, when almost nobody knows an exit yet."""
+    states = model.get_evacuees_states()
+    ranks = model.get_arrival_ranks()
+    exit_maps = [model.exit_maps[k] for k in range(len(model.exit_maps))]
+
+    model.remove_evacuees()
+    model.place_evacuees([(uid, pos, int(np.argmin([exit_map[pos] for exit_map in exit_maps])) if i % every == 0
+                           else exit_id) for i, (uid, pos, exit_id) in enumerate(states)])
+    model.set_arrival_ranks(ranks)
+    model.world_version += 1
+
+
+def measure(function: Callable[[], float], repeats: int) -> Dict:
+    """function returns its own measured time, so setup it does before measurement is not counted."""
+    times = [function() for _ in range(repeats)]
+    return {"times": times, "min": min(times), "median": statistics.median(times)}
+
+
+def timed(function: Callable[[], None]) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def bench_model_init(model_class, model_params: Dict, repeats: int) -> Dict:
+    new_model(model_class, model_params)  # extractor maps are computed and cached once, see bench_extractor_maps
+    return measure(lambda: timed(lambda: new_model(model_class, model_params)), repeats)
+
+
+def bench_square_rounded_map(model_class, model_params: Dict, repeats: int) -> Dict:
+    model = new_model(model_class, model_params)
+    exit_positions = model.grid.positions_by_breed[Exit][0]
+    start_position = exit_positions[len(exit_positions) // 2]
+
+    return measure(lambda: timed(lambda: model.grid.generate_square_rounded_map(start_position, exit_positions)),
+                   repeats)
+
+
+def bench_extractor_maps(model_class, model_params: Dict, repeats: int) -> Dict:
+    model = new_model(model_class, model_params)
+
+    # without cache, so the maps are really computed
+    return measure(lambda: timed(lambda: get_feature_extractor_maps(model.grid, n_jobs=-1, cache_dir=None)), repeats)
+
+
+def bench_landmark_distances(model_class, model_params: Dict, repeats: int) -> Dict:
+    model = new_model(model_class, model_params)
+    return measure(lambda: timed(lambda: get_landmark_distances(model.grid, LANDMARKS, cache_dir=None)), repeats)
+
+
+def bench_scheduler_step(model_class, model_params: Dict, repeats: int) -> Dict:
+    def run() -> float:
+        model = new_model(model_class, model_params)
+        inform_evacuees(model)
+        return statistics.mean(timed(model.schedule.step) for _ in range(STEPS_MEASURED))
+
+    result = measure(run, repeats)
+    result["steps"] = STEPS_MEASURED
+    return result
+
+
+def bench_get_features(model_class, model_params: Dict, repeats: int) -> Dict:
+    model = new_model(model_class, model_params)
+    for _ in range(STEPS_BEFORE_FEATURES):
+        model.step()
+
+    state = model.get_simulation_state()
+    guides = model.schedule.get_breed_agents(GuideQLearning)
+
+    def run() -> float:
+        calls = 0
+        total = 0.0
+        for guide in guides:
+            guide.extractor.features_cache_key = None  # drop memoized features, every call computes them
+            actions = state.grid.get_legal_actions(guide.pos, state.ghost_agents)
+            total += timed(lambda: [guide.extractor.get_features(state, action) for action in actions])
+            calls += len(actions)
+
+        return total / max(calls, 1)
+
+    return measure(run, repeats)
+
+
+BENCHMARKS = {
+    'model_init': bench_model_init,
+    'generate_square_rounded_map': bench_square_rounded_map,
+    'get_feature_extractor_maps': bench_extractor_maps,
+    'get_landmark_distances': bench_landmark_distances,
+    'scheduler_step': bench_scheduler_step,
+    'get_features': bench_get_features,
+}
+
+
+def run_case(results: List[Dict], benchmark: str, engine: str, model_params: Dict, repeats: int) -> None:
+    case = {"benchmark": benchmark, "engine": engine, "map_type": model_params["map_type"],
+            "grid_size": model_params["width"], "evacuees_num": model_params["evacuees_num"]}
+
+    size = model_params["width"]
+    all_pairs = get_maps_bytes(size) <= MAX_MAPS_BYTES
+    case["distances"] = "all_pairs" if all_pairs else f"landmarks_{LANDMARKS}"
+
+    if benchmark == 'get_feature_extractor_maps' and not all_pairs:
+        case["skipped"] = f"all-pairs extractor maps need {get_maps_bytes(size) / 2 ** 30:.1f} GiB"
+    else:
+        EvacuationWorld.distance_landmarks = 0 if all_pairs else LANDMARKS
+        try:
+            case.update(BENCHMARKS[benchmark](ENGINES[engine], model_params, repeats))
+        finally:
+            EvacuationWorld.distance_landmarks = 0
+
+    results.append(case)
+    print(json.dumps({k: v for k, v in case.items() if k != "times"}))
+
+
+def run_benchmarks(engines: List[str], grid_sizes: List[int], evacuees_nums: List[int], evacuees_grid_size: int,
+                   repeats: int = REPEATS) -> List[Dict]:
+    """Scaling curves over grid size (every benchmark, model init for every map type) and over number of evacuees
+    (scheduler step and features, on evacuees_grid_size grid)."""
+    results = []
+    for engine in engines:
+        for size in grid_sizes:
+            evacuees_num = size * size // 10
+            for map_type in MAP_TYPES:
+                run_case(results, 'model_init', engine, get_model_params(size, evacuees_num, map_type), repeats)
+
+            for benchmark in ['generate_square_rounded_map', 'get_feature_extractor_maps', 'get_landmark_distances',
+                              'scheduler_step', 'get_features']:
+                run_case(results, benchmark, engine, get_model_params(size, evacuees_num), repeats)
+
+        for evacuees_num in evacuees_nums:
+            for benchmark in ['scheduler_step', 'get_features']:
+                run_case(results, benchmark, engine, get_model_params(evacuees_grid_size, evacuees_num), repeats)
+
+    return results
+
+
+def get_case_key(case: Dict) -> tuple:
+    return (case["benchmark"], case["engine"], case["map_type"], case["grid_size"], case["evacuees_num"],
+            case.get("distances", "all_pairs"))
+
+
+def compare_results(old_path: str, new_path: str) -> None:
+    """Prints median time of every case present in both files, with speedup of the new run over the old one."""
+    with open(old_path, "r") as f:
+        old_cases = {get_case_key(case): case for case in json.load(f)["results"] if "median" in case}
+    with open(new_path, "r") as f:
+        new_cases = {get_case_key(case): case for case in json.load(f)["results"] if "median" in case}
+
+    for key in sorted(old_cases.keys() & new_cases.keys(), key=str):
+        old_median, new_median = old_cases[key]["median"], new_cases[key]["median"]
+        print(f"{' '.join(map(str, key))}: {old_median:.6f}s -> {new_median:.6f}s ({old_median / new_median:.2f}x)")
+
+
+def get_git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks of model init, maps, scheduler step and features.")
+    parser.add_argument("--output", help="JSON results file, by default output/benchmarks/<date>.json")
+    parser.add_argument("--engine", choices=list(ENGINES), action="append", help="engines to run, by default mesa")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--quick", action="store_true", help="only small grids and evacuees numbers")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two results files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+        sys.exit()
+
+    if args.quick:
+        run_args = (QUICK_GRID_SIZES, QUICK_EVACUEES_NUMS, QUICK_EVACUEES_GRID_SIZE)
+    else:
+        run_args = (GRID_SIZES, EVACUEES_NUMS, EVACUEES_GRID_SIZE)
+
+    started = datetime.now()
+    results = run_benchmarks(args.engine or ['mesa'], *run_args, repeats=args.repeats)
+
+    output = args.output or os.path.join("output", "benchmarks", f"{started:%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:  # Save results to file
+        meta = {"date": started.isoformat(), "git_commit": get_git_commit(), "python": platform.python_version(),
+                "numpy": np.__version__, "platform": platform.platform(), "cpu_count": os.cpu_count(), "seed": SEED,
+                "repeats": args.repeats, "max_maps_bytes": MAX_MAPS_BYTES}
+        f.write(json.dumps({"meta": meta, "results": results}, indent=1))
+
+    print(f"Results saved to {output}")
@@ -1,12 +1,14 @@
 import json
 import os
 
+import numpy as np
 from mesa.visualization.ModularVisualization import ModularServer
 from mesa.visualization.modules import CanvasGrid, ChartModule
 from mesa.visualization.UserParam import Slider, Checkbox, Choice, StaticText
 
-from agents.agents import Evacuee, GuideAgent, Exit, Obstacle, MapInfo
+from agents.agents import Evacuee, GuideAgent, Exit, Obstacle
 from simulation.model import EvacuationModel
+from simulation.world import EvacuationWorld
 
 
 def agents_portrayal(agent):  # Describes look of every agent
@@ -30,38 +32,37 @@ def agents_portrayal(agent):  # Describes look of every agent
         portrayal["Layer"] = 1
         portrayal["r"] = 1
 
-    elif type(agent) is Exit:
-        portrayal["Color"] = "green"
-        portrayal["Shape"] = "rect"
-        portrayal["Filled"] = "true"
-        portrayal["Layer"] = 0
-        portrayal["w"] = 1
-        portrayal["h"] = 1
+    return portrayal
 
-    elif type(agent) is Obstacle:
-        portrayal["Color"] = "grey"
-        portrayal["Shape"] = "rect"
-        portrayal["Filled"] = "true"
-        portrayal["Layer"] = 0
-        portrayal["w"] = 1
-        portrayal["h"] = 1
-    elif type(agent) is MapInfo:
-        portrayal["Color"] = agent.color
-        portrayal["Shape"] = "rect"
-        portrayal["Filled"] = "true"
-        portrayal["w"] = 1
-        portrayal["h"] = 1
-        portrayal["Layer"] = 2
-        portrayal["text"] = str(agent.value)
-        portrayal["text_color"] = "black"
 
-    return portrayal
+def cell_portrayal(color: str, layer: int) -> dict:  # Describes look of static map cells
+    return {"Color": color, "Shape": "rect", "Filled": "true", "Layer": layer, "w": 1, "h": 1}
+
+
+class EvacuationCanvasGrid(CanvasGrid):
+    """Draws agents like CanvasGrid and static map content (exits, obstacles, distance map) from layers of the grid."""
+
+    def render(self, model):
+        grid_state = super().render(model)
+        grid = model.grid
+
+        for breed, color in ((Exit, "green"), (Obstacle, "grey")):
+            for x, y in np.argwhere(grid.layers[breed]).tolist():
+                grid_state[0].append(dict(cell_portrayal(color, 0), x=x, y=y))
+
+        if grid.map_values is not None:
+            for (x, y), value in np.ndenumerate(grid.map_values):
+                grid_state[2].append(dict(cell_portrayal("transparent", 2), x=x, y=y, text=str(value),
+                                          text_color="black"))
+
+        return grid_state
 
 
 # Basic parameters of gui
 HEIGHT = WIDTH = 1050
-canvas_element = CanvasGrid(agents_portrayal, WIDTH, HEIGHT, 950, 550)
-chart_element = ChartModule([{"Label": "Evacuees", "Color": "#AA0000"}])
+EvacuationWorld.distance_landmarks = 16  # all pairs distance maps of this grid don't fit in memory
+canvas_element = EvacuationCanvasGrid(agents_portrayal, WIDTH, HEIGHT, 950, 550)
+chart_element = ChartModule([{"Label": "evacuees", "Color": "#AA0000"}], data_collector_name="metrics")
 
 model_params = {  # Parameters of model, wrapped into gui objects
 
@@ -79,6 +80,7 @@ model_params = {  # Parameters of model, wrapped into gui objects
 
     "Evacuees Info": StaticText("Evacuees settings:"),
     "evacuees_share_information": Checkbox("Evacuees share exit area information", False),
+    "evacuees_batched_moves": Checkbox("Evacuees move simultaneously (batched)", False),
     "evacuees_num": Slider("Number of Evacuees", 500, 1, 2000),
 
     "Map Info": StaticText("Map settings:"),
@@ -3,9 +3,13 @@ import os
 from multiprocessing import set_start_method
 from typing import Dict
 
+from agents.agents_guides import weights_to_dict
 from agents.feature_extractor import FeatureExtractor
 from simulation.grid import EvacuationGrid
+from simulation.lean_model import LeanEvacuationModel
 from simulation.model import EvacuationModel, get_feature_extractor_maps
+from simulation.training import train_parallel, start_episode
+from simulation.world import EvacuationWorld
 
 HEIGHT = WIDTH = 100
 
@@ -23,6 +27,7 @@ model_params = {  # Parameters of model
 
     "evacuees_num": 1000,
     "evacuees_share_information": True,
+    "evacuees_batched_moves": False,
 
     "map_type": 'default',
 
@@ -44,21 +49,52 @@ if __name__ == '__main__':
     epsilon_min = 0.2
     epsilon_diff = (qlearning_params['epsilon'] - epsilon_min) / n_games
 
-    # Training loop
-    for i in range(n_games):
-        model = EvacuationModel(**model_params)
-        model.run_model()
-        model.reset_randomizer()
+    # Games run at once in process pool from the same weights snapshot (-1 uses all cores, 1 keeps sequential loop)
+    n_jobs = 1
+    seed = 0  # game i is seeded with seed + i in parallel training
+    merge_rule = 'sequential'  # see simulation.training.MERGE_RULES
 
-        print(f"it: {i}; steps: {model.schedule.steps}; qlearning_params: {qlearning_params}")
+    # Lean engine gives the same simulations as mesa one, without mesa grid (check: python -m simulation.lean_model)
+    lean_engine = False
+    model_class = LeanEvacuationModel if lean_engine else EvacuationModel
 
-        qlearning_params = model.qlearning_params
-        model_params["extractor_maps"] = FeatureExtractor.maps
+    # Extractor maps computed when guides need them instead of all before the first step (see LazyDistanceMaps)
+    EvacuationWorld.lazy_maps = False
+    EvacuationWorld.lazy_maps_prefetch = False
 
-        if qlearning_params['epsilon'] >= epsilon_min:  # Epsilon decrease every new simulation
-            qlearning_params['epsilon'] -= epsilon_diff
+    # Time of step phases and calls of hot methods, streamed for every step as JSON lines (see simulation.profiling)
+    profiling_path = None
+    if profiling_path is not None:
+        EvacuationWorld.profiling = True
+        EvacuationWorld.profiling_path = profiling_path
 
-        model_params['qlearning_params'] = qlearning_params
+    # Agents positions after every step, streamed as .npy segments (read with simulation.recording.TrajectoryReader)
+    recording_path = None
+    if recording_path is not None:
+        EvacuationWorld.recording_path = recording_path
+
+    if n_jobs != 1:  # Parallel training loop
+        def print_episode(i, steps, episode_qlearning_params):
+            print(f"it: {i}; steps: {steps}; qlearning_params: {episode_qlearning_params}")
+
+        qlearning_params = train_parallel(model_params, n_games, epsilon_min, n_jobs=n_jobs, seed=seed,
+                                          merge_rule=merge_rule, on_episode=print_episode, model_class=model_class)
+    else:  # Training loop
+        model = None
+        for i in range(n_games):
+            model = start_episode(model, model_params, model_class)
+            model.run_model()
+            model.reset_randomizer()
+
+            print(f"it: {i}; steps: {model.schedule.steps}; qlearning_params: {qlearning_params}")
+
+            qlearning_params = model.qlearning_params
+            model_params["extractor_maps"] = FeatureExtractor.maps
+
+            if qlearning_params['epsilon'] >= epsilon_min:  # Epsilon decrease every new simulation
+                qlearning_params['epsilon'] -= epsilon_diff
+
+            model_params['qlearning_params'] = qlearning_params
 
     with open(f"output/weights.txt", "w") as f:  # Save results to file
-        f.write(json.dumps(qlearning_params['weights']))
+        f.write(json.dumps(weights_to_dict(qlearning_params['weights'])))
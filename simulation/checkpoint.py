@@ -0,0 +1,166 @@
+import json
+import random
+
+import numpy as np
+
+from agents.agents import Sensor
+from agents.agents_guides import GuideQLearning
+from agents.feature_extractor import FeatureExtractor, FEATURES, get_maps_cache_key, get_unvisited_index
+from simulation.metrics import MetricsBuffer
+
+CHECKPOINT_VERSION = 2
+
+
+def get_world_key(model) -> str:
+    # Extractor maps cache key identifies obstacles layout, exits and sensors depend only on grid size
+    return get_maps_cache_key(model.grid.get_obstacles_mask())
+
+
+def save_checkpoint(model, path: str) -> None:
+    """Saves dynamic state of running model to binary .npz file: agents, guides learning, feature extractor, random
+    generators, counters and metrics. Map is stored only as the key of its extractor maps cache, checkpoint can be
+    loaded into any model of the same world, see load_checkpoint."""
+    guides = model.schedule.get_breed_agents(GuideQLearning)
+
+    # Guides created with the same weights learn into one vector, aliases are kept as indexes into weights
+    weights, weights_ids = [], dict()
+    qlearning_weights = None if model.qlearning_params is None else model.qlearning_params['weights']
+    for w in [guide.weights for guide in guides] + [qlearning_weights]:
+        if w is not None and id(w) not in weights_ids:
+            weights_ids[id(w)] = len(weights)
+            weights.append(w)
+
+    evacuees = model.get_evacuees_states()
+    ranks = model.get_arrival_ranks()
+    python_random = random.getstate()
+    model_random = model.random.getstate()
+    numpy_random = np.random.get_state()
+
+    meta = {
+        "version": CHECKPOINT_VERSION, "engine": type(model).__name__, "world_key": get_world_key(model),
+        "steps": model.schedule.steps, "time": model.schedule.time, "current_id": model.current_id,
+        "world_version": model.world_version, "running": model.running,
+        "qlearning_params": None if model.qlearning_params is None else {
+            k: v for k, v in model.qlearning_params.items() if k != 'weights'},
+        "qlearning_weights": -1 if qlearning_weights is None else weights_ids[id(qlearning_weights)],
+        "guides_last_action": [getattr(guide, 'last_action', None) for guide in guides],
+        "sensors": [sensor.evacuees_in_area for sensor in model.schedule.get_breed_agents(Sensor)],
+        "informed_evacuees": FeatureExtractor.informed_evacuees,
+        "unvisited_version": FeatureExtractor.unvisited.version,
+        "python_random": [python_random[0], python_random[2]], "model_random": [model_random[0], model_random[2]],
+        "numpy_random": [numpy_random[0], numpy_random[2], numpy_random[3], numpy_random[4]],
+        "metrics_guides": model.metrics_guides, "metrics_columns": model.metrics.columns,
+    }
+
+    arrays = {
+        "evacuees_uids": np.array([uid for uid, _, _ in evacuees], dtype=np.int64),
+        "evacuees_positions": np.array([pos for _, pos, _ in evacuees], dtype=np.int32).reshape(-1, 2),
+        "evacuees_exits": np.array([-1 if e is None else e for _, _, e in evacuees], dtype=np.int16),
+        "evacuees_ranks": np.array([ranks[uid] for uid, _, _ in evacuees], dtype=np.int64),
+        "guides_uids": np.array([guide.unique_id for guide in guides], dtype=np.int64),
+        "guides_positions": np.array([guide.pos for guide in guides], dtype=np.int32).reshape(-1, 2),
+        "guides_ranks": np.array([ranks[guide.unique_id] for guide in guides], dtype=np.int64),
+        "guides_params": np.array([(guide.epsilon, guide.gamma, guide.alpha, guide.lifepoints, guide.score)
+                                   for guide in guides], dtype=float).reshape(-1, 5),
+        "guides_weights": np.array([weights_ids[id(guide.weights)] for guide in guides], dtype=np.int64),
+        "guides_last_feats": np.array([np.full(len(FEATURES), np.nan) if guide.last_feats is None
+                                       else FeatureExtractor.features_to_vector(guide.last_feats) for guide in guides],
+                                      dtype=float).reshape(-1, len(FEATURES)),
+        "weights": np.array(weights, dtype=float).reshape(-1, len(FEATURES)),
+        "evacuated_by_exit": model.evacuated_by_exit,
+        "metrics": model.metrics.get_array(),
+        "unvisited": np.packbits(FeatureExtractor.unvisited.unvisited),
+        "python_random": np.array(python_random[1], dtype=np.uint32),
+        "model_random": np.array(model_random[1], dtype=np.uint32),
+        "numpy_random": numpy_random[1],
+    }
+
+    with open(path, "wb") as f:
+        np.savez_compressed(f, meta=np.array(json.dumps(meta)), **arrays)
+
+
+def load_checkpoint(model, path: str) -> None:
+    """Restores state saved by save_checkpoint into model of the same world (the same grid size and obstacles, from
+    any engine). World, exits maps and extractor maps of the model are reused, only agents and counters are replaced,
+    so the run continues exactly as the saved one would."""
+    with np.load(path) as data:
+        arrays = dict(data)
+    meta = json.loads(str(arrays.pop("meta")))
+
+    if meta["version"] != CHECKPOINT_VERSION:
+        raise ValueError(f"Checkpoint version {meta['version']} is not supported, expected {CHECKPOINT_VERSION}")
+    if meta["world_key"] != get_world_key(model):
+        raise ValueError("Checkpoint was saved in another world, map of the model has to be the same")
+
+    model.journal = None
+    model.snapshots = []
+    for guide in model.schedule.get_breed_agents(GuideQLearning):
+        model.grid.remove_agent(guide)
+        model.schedule.remove(guide)
+    model.remove_evacuees()
+
+    # GUIDES
+    weights = [w.copy() for w in arrays["weights"]]
+    for i, uid in enumerate(arrays["guides_uids"].tolist()):
+        epsilon, gamma, alpha, lifepoints, score = arrays["guides_params"][i].tolist()
+        pos = tuple(arrays["guides_positions"][i].tolist())
+
+        guide = GuideQLearning(uid=uid, pos=pos, random_seed=model.random, epsilon=epsilon, gamma=gamma, alpha=alpha,
+                               weights=weights[int(arrays["guides_weights"][i])])
+        guide.lifepoints = lifepoints
+        guide.score = score
+        if not np.isnan(arrays["guides_last_feats"][i]).any():
+            guide.last_feats = dict(zip(FEATURES, arrays["guides_last_feats"][i].tolist()))
+        if meta["guides_last_action"][i] is not None:
+            guide.last_action = meta["guides_last_action"][i]
+
+        model.grid.place_agent(guide, pos)
+        model.schedule.add(guide)
+
+    # EVACUEES
+    exits = [None if e < 0 else e for e in arrays["evacuees_exits"].tolist()]
+    positions = [tuple(pos) for pos in arrays["evacuees_positions"].tolist()]
+    model.place_evacuees(list(zip(arrays["evacuees_uids"].tolist(), positions, exits)))
+
+    ranks = dict(zip(arrays["evacuees_uids"].tolist(), arrays["evacuees_ranks"].tolist()))
+    ranks.update(zip(arrays["guides_uids"].tolist(), arrays["guides_ranks"].tolist()))
+    model.set_arrival_ranks(ranks)
+
+    for sensor, evacuees_in_area in zip(model.schedule.get_breed_agents(Sensor), meta["sensors"]):
+        sensor.evacuees_in_area = evacuees_in_area
+
+    # COUNTERS
+    model.schedule.steps = meta["steps"]
+    model.schedule.time = meta["time"]
+    model.current_id = meta["current_id"]
+    model.world_version = meta["world_version"]
+    model.running = meta["running"]
+    model.evacuated_by_exit = arrays["evacuated_by_exit"].astype(int)
+    model.metrics_guides = meta["metrics_guides"]
+    model.metrics = MetricsBuffer.from_array(meta["metrics_columns"], arrays["metrics"])
+
+    model.qlearning_params = meta["qlearning_params"]
+    if model.qlearning_params is not None:
+        model.qlearning_params['weights'] = weights[meta["qlearning_weights"]]
+
+    # FeatureExtractor
+    FeatureExtractor.maps = model.extractor_maps
+    FeatureExtractor.informed_evacuees = meta["informed_evacuees"]
+    FeatureExtractor.unvisited = get_unvisited_index(FeatureExtractor.maps, model.grid.width, model.grid.height)
+    FeatureExtractor.unvisited.unvisited[:] = np.unpackbits(
+        arrays["unvisited"], count=model.grid.width * model.grid.height).reshape(model.grid.width,
+                                                                                 model.grid.height).astype(bool)
+    FeatureExtractor.unvisited.version = meta["unvisited_version"]
+
+    # RANDOM GENERATORS
+    version, gauss_next = meta["python_random"]
+    random.setstate((version, tuple(arrays["python_random"].tolist()), gauss_next))
+    version, gauss_next = meta["model_random"]
+    model.random.setstate((version, tuple(arrays["model_random"].tolist()), gauss_next))
+    name, pos, has_gauss, cached_gaussian = meta["numpy_random"]
+    np.random.set_state((name, arrays["numpy_random"], pos, has_gauss, cached_gaussian))
+
+    if model.profiler is not None:
+        model.profiler.attach(model)
+    if model.recorder is not None:  # recorded as new episode starting at the loaded step
+        model.recorder.attach(model)
@@ -0,0 +1,66 @@
+from typing import Iterable, Tuple
+
+import numpy as np
+
+
+def dilate(mask: np.ndarray, moore: bool) -> np.ndarray:
+    """Grows every True cell of the last two axes by one tile, in Moore (x shape and + shape) or von Neumann (+ shape)
+    neighbourhood. Leading axes are treated as a batch."""
+    grown = mask.copy()
+    grown[..., 1:, :] |= mask[..., :-1, :]
+    grown[..., :-1, :] |= mask[..., 1:, :]
+
+    if moore:  # square dilation is separable, so x-grown mask is grown along y
+        source = grown.copy()
+    else:
+        source = mask
+
+    grown[..., :, 1:] |= source[..., :, :-1]
+    grown[..., :, :-1] |= source[..., :, 1:]
+
+    return grown
+
+
+def square_rounded_distances(open_mask: np.ndarray, start_positions: Iterable[Tuple[int, int]]) -> np.ndarray:
+    """Returns array of shape (len(start_positions), width, height) with "square rounded" distance from each start
+    position to every cell. Frontier is grown alternately with Moore (even distances) and von Neumann (odd distances)
+    neighbourhood, only through cells of open_mask. Cells that were not reached are set to -1."""
+    xs, ys = np.array(list(start_positions), dtype=np.intp).reshape(-1, 2).T
+    batch = np.arange(len(xs))
+
+    distances = np.full((len(xs),) + open_mask.shape, -1, dtype=np.int64)
+    distances[batch, xs, ys] = 0
+
+    frontier = np.zeros(distances.shape, dtype=bool)
+    frontier[batch, xs, ys] = open_mask[xs, ys]  # start on obstacle does not spread
+
+    unmeasured = np.broadcast_to(open_mask, distances.shape) & ~frontier
+
+    distance = 0
+    while frontier.any():
+        frontier = dilate(frontier, moore=distance % 2 == 0)
+        frontier &= unmeasured
+        unmeasured &= ~frontier
+
+        distance += 1
+        distances[frontier] = distance
+
+    return distances
+
+
+def square_rounded_maps(open_mask: np.ndarray, start_positions: Iterable[Tuple[int, int]],
+                        exits_masks: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns distance maps for every start position together with masks of unreachable open cells. Unreachable
+    cells get the longest route of their map, exits get 0 and obstacles get the maximal value of the map."""
+    maps = square_rounded_distances(open_mask, start_positions)
+    unreachable = (maps < 0) & open_mask
+
+    maps[maps < 0] = 0
+    np.copyto(maps, maps.max(axis=(1, 2), keepdims=True), where=unreachable)
+
+    if exits_masks is not None:
+        maps[np.broadcast_to(exits_masks, maps.shape)] = 0
+
+    np.copyto(maps, maps.max(axis=(1, 2), keepdims=True), where=~open_mask)
+
+    return maps, unreachable
@@ -1,50 +1,221 @@
 from collections import defaultdict
+from collections.abc import Mapping
 from copy import deepcopy
 from itertools import product
-from typing import Tuple, Set, Dict, List
+from typing import Tuple, Set, Dict, List, Type, Any
 
 import numpy as np
 from mesa.space import MultiGrid
 
-from agents.agents import Obstacle, Evacuee, GuideAgent
+from agents.agents import Obstacle, Evacuee, GuideAgent, StateAgent, Sensor
+from simulation.distance_field import square_rounded_maps
 
 
-class EvacuationGrid(MultiGrid):
+class BreedPositions(Mapping):
+    """Read-only compatibility view of positions occupied by each breed, backed by occupancy layers of the grid.
+    Static map content assigned directly (e.g. exit areas) is kept as it was given."""
+
+    def __init__(self, grid: 'EvacuationGrid') -> None:
+        self.grid = grid
+        self.static = dict()
+
+    def __getitem__(self, breed: Type) -> Any:
+        if breed in self.static:
+            return self.static[breed]
+
+        return set(map(tuple, np.argwhere(self.grid.layers[breed]).tolist()))
+
+    def __setitem__(self, breed: Type, positions: Any) -> None:
+        self.static[breed] = positions
+
+    def __iter__(self):
+        return iter(set(self.grid.layers) | set(self.static))
+
+    def __len__(self) -> int:
+        return len(set(self.grid.layers) | set(self.static))
+
+
+def build_legal_moves_table(moves: Tuple[Tuple[str, Tuple[int, int]], ...]) -> Tuple[Tuple[Tuple[str, int, int]]]:
+    """Returns table, which for every 8-bit mask of open directions gives (action, x_mod, y_mod) of open moves."""
+    table = []
+    for mask in range(2 ** len(moves)):
+        table.append(tuple((k, x_mod, y_mod) for i, (k, (x_mod, y_mod)) in enumerate(moves) if mask >> i & 1))
+
+    return tuple(table)
+
+
+class GridLayers:
+    """Array side of the grid shared by simulation engines: occupancy layers of every breed, open directions and all
+    queries, which can be answered from them. Engines keep layers updated with add_to_layers and remove_from_layers."""
+
     # Point (0x,0y) is in LEFT BOTTOM; U-Up, D-Down, L-Left, M-Middle, R-Right;
     action_position_map = {'UL': (-1, +1), 'UM': (0, +1), 'UR': (+1, +1), 'ML': (-1, 0), 'MM': (0, 0), 'MR': (+1, 0),
                            'DL': (-1, -1), 'DM': (0, -1), 'DR': (+1, -1)}
 
-    def __init__(self, width: int, height: int, torus: bool) -> None:
-        super().__init__(width, height, torus)
-        self.positions_by_breed = defaultdict(lambda: set())
+    # Bit i of open_directions tells whether move i is open
+    moves = tuple((k, v) for k, v in action_position_map.items() if k != 'MM')
+    legal_moves_table = build_legal_moves_table(moves)
 
-    def get_legal_positions(self, pos: Tuple[int, int], ghost_agents: bool) -> Set[Tuple[int, int]]:
-        legal_positions = set(self.get_neighborhood(pos, True, include_center=False, radius=1))
+    width: int
+    height: int
 
-        legal_positions -= self.positions_by_breed[Obstacle]
-        if not ghost_agents:
-            legal_positions -= (self.positions_by_breed[Evacuee].union(self.positions_by_breed[GuideAgent]))
+    def init_layers(self) -> None:
+        # Number of agents of each breed standing on every cell, updated in place on place/move/remove
+        self.layers = defaultdict(lambda: np.zeros((self.width, self.height), dtype=np.uint16))
+        self.positions_by_breed = BreedPositions(self)
+        self.sensors_by_cell = defaultdict(list)
 
-        # legal_positions.add(pos)
-        return legal_positions
+        # Exit area id of every cell (-1 for other cells) and exit cells in the order, in which exits are activated
+        self.exit_areas = np.full((self.width, self.height), -1, dtype=np.intp)
+        self.exit_xs = np.zeros(0, dtype=np.intp)
+        self.exit_ys = np.zeros(0, dtype=np.intp)
 
-    def get_legal_actions_with_positions(self, pos: Tuple[int, int], ghost_agents: bool) -> Dict[str, Tuple[int, int]]:
+        self.map_values = None  # distance map shown on every cell with show_map
+
+        self.open_directions = None
+        self.update_open_directions()
+
+    def add_to_layers(self, breed: Type, pos: Tuple[int, int]) -> None:
+        layer = self.layers[breed]
+        layer[pos] += 1
+        if breed is Evacuee and layer[pos] == 1:
+            for sensor in self.sensors_by_cell.get(pos, ()):
+                sensor.evacuees_count += 1
+
+    def remove_from_layers(self, breed: Type, pos: Tuple[int, int]) -> None:
+        layer = self.layers[breed]
+        layer[pos] -= 1
+        if breed is Evacuee and layer[pos] == 0:
+            for sensor in self.sensors_by_cell.get(pos, ()):
+                sensor.evacuees_count -= 1
+
+    def place_static(self, breed: Type, positions) -> None:
+        """Static map content (obstacles, exits) is stored only in the breed layer, without agent objects."""
+        for pos in positions:
+            self.layers[breed][pos] += 1
+
+    def add_sensor(self, sensor: Sensor) -> None:
+        """Registers sensing area of sensor, from now on its evacuees count is updated on every evacuee move."""
+        for pos in sensor.sensing_positions:
+            self.sensors_by_cell[pos].append(sensor)
+
+        sensor.evacuees_count = int(np.count_nonzero(self.layers[Evacuee][sensor.sensing_indices]))
+
+    def init_exit_areas(self, exits_positions: Dict[int, List[Tuple[int, int]]]) -> None:
+        """Registers exit cells of every exit area, exits are activated in the order of exits_positions."""
+        positions = [pos for area in exits_positions.values() for pos in area]
+        self.exit_xs, self.exit_ys = np.array(positions, dtype=np.intp).reshape(-1, 2).T.copy()
+
+        for area_id, area in exits_positions.items():
+            for pos in area:
+                self.exit_areas[pos] = area_id
+
+    def get_exit_ranks(self) -> np.ndarray:
+        """Returns position of every cell in exits activation order, -1 for cells which are not exits."""
+        ranks = np.full((self.width, self.height), -1, dtype=np.intp)
+        ranks[self.exit_xs, self.exit_ys] = np.arange(len(self.exit_xs))
+        return ranks
+
+    def get_occupied_exits(self) -> List[Tuple[int, int]]:
+        """Returns exit cells with evacuees or guides on them, in exits activation order. Only exit cells of the
+        occupancy layers are read, so cost does not depend on grid size."""
+        occupied = np.zeros(len(self.exit_xs), dtype=bool)
+        for breed, layer in self.layers.items():
+            if issubclass(breed, (Evacuee, GuideAgent)):
+                occupied |= layer[self.exit_xs, self.exit_ys] > 0
+
+        return list(zip(self.exit_xs[occupied].tolist(), self.exit_ys[occupied].tolist()))
+
+    def update_open_directions(self) -> None:
+        """Computes 8-bit mask of moves, which don't lead outside the grid or into an obstacle, for every cell. Map
+        borders and obstacles don't change during simulation, so it has to be called only after obstacles placement."""
+        open_mask = np.pad(~self.get_obstacles_mask(), 1, constant_values=False)
+
+        self.open_directions = np.zeros((self.width, self.height), dtype=np.uint8)
+        for i, (_, (x_mod, y_mod)) in enumerate(self.moves):
+            neighbor_open = open_mask[1 + x_mod:1 + x_mod + self.width, 1 + y_mod:1 + y_mod + self.height]
+            self.open_directions |= neighbor_open.astype(np.uint8) << i
+
+    def is_position_occupied(self, pos: Tuple[int, int]) -> bool:
+        return bool(self.layers[Evacuee][pos] or self.layers[GuideAgent][pos])
+
+    def get_legal_moves(self, pos: Tuple[int, int], ghost_agents: bool) -> Tuple[Tuple[str, int, int], ...]:
+        """Returns (action, x_mod, y_mod) of every legal action, in action_position_map order."""
         x, y = pos
-        all_actions = dict()
-        for k, (x_mod, y_mod) in EvacuationGrid.action_position_map.items():
-            all_actions.update({k: (x + x_mod, y + y_mod)})
+        moves = self.legal_moves_table[self.open_directions[x, y]]
+
+        if ghost_agents:
+            return moves
+
+        return tuple(move for move in moves if not self.is_position_occupied((x + move[1], y + move[2])))
+
+    def get_occupied_mask(self) -> np.ndarray:
+        return (self.layers[Evacuee] > 0) | (self.layers[GuideAgent] > 0)
+
+    def get_open_moves(self, xs: np.ndarray, ys: np.ndarray,
+                       ghost_agents: bool) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Vectorized get_legal_moves for agents at xs, ys. Returns mask of legal moves (agent x move, in moves order)
+        and coordinates of their target cells, closed moves point to the cell of the agent."""
+        offsets = np.array([v for _, v in self.moves])
+        targets_x = xs[:, None] + offsets[:, 0]
+        targets_y = ys[:, None] + offsets[:, 1]
+
+        open_moves = (self.open_directions[xs, ys][:, None] >> np.arange(len(self.moves), dtype=np.uint8)) & 1 > 0
+        targets_x = np.where(open_moves, targets_x, xs[:, None])  # closed moves point inside the grid
+        targets_y = np.where(open_moves, targets_y, ys[:, None])
+
+        if not ghost_agents:
+            open_moves &= ~self.get_occupied_mask()[targets_x, targets_y]
 
-        legal_positions = self.get_legal_positions(pos, ghost_agents)
-        legal_actions = dict()
+        return open_moves, targets_x, targets_y
 
-        for k, v in all_actions.items():
-            if v in legal_positions:
-                legal_actions.update({k: v})
+    def get_best_moves(self, xs: np.ndarray, ys: np.ndarray, exit_ids: np.ndarray, exit_maps: np.ndarray,
+                       ghost_agents: bool) -> np.ndarray:
+        """Vectorized choice of move for many agents at once. Agents (rows of xs, ys, exit_ids) have to be ordered by
+        priority; exit_maps is array of distance maps indexed by exit id. Every agent takes its closest legal move and
+        when several agents want the same cell, the first one gets it and the others take their next best move.
+        Occupancy is read at the beginning, so cells vacated during the same step are not used. Returns index in moves
+        for each agent, -1 if agent can not move."""
+        open_moves, targets_x, targets_y = self.get_open_moves(xs, ys, ghost_agents)
 
-        return legal_actions
+        distances = exit_maps[exit_ids[:, None], targets_x, targets_y].astype(float)
+        distances[~open_moves] = np.inf
+
+        best_moves = np.full(len(xs), -1)
+        claimed = np.zeros((self.width, self.height), dtype=bool)
+        unresolved = np.arange(len(xs))
+        while len(unresolved) > 0:
+            candidates = distances[unresolved].argmin(axis=1)
+            movable = np.isfinite(distances[unresolved, candidates])
+            unresolved, candidates = unresolved[movable], candidates[movable]
+
+            if ghost_agents:  # agents can share cells, no conflicts
+                best_moves[unresolved] = candidates
+                break
+
+            cells = targets_x[unresolved, candidates] * self.height + targets_y[unresolved, candidates]
+            _, first = np.unique(cells, return_index=True)  # unresolved is sorted, so first means highest priority
+
+            winners = unresolved[first]
+            best_moves[winners] = candidates[first]
+            claimed[targets_x[winners, candidates[first]], targets_y[winners, candidates[first]]] = True
+
+            unresolved = np.delete(unresolved, first)
+            distances[unresolved] = np.where(claimed[targets_x[unresolved], targets_y[unresolved]], np.inf,
+                                             distances[unresolved])
+
+        return best_moves
+
+    def get_legal_positions(self, pos: Tuple[int, int], ghost_agents: bool) -> Set[Tuple[int, int]]:
+        x, y = pos
+        return {(x + x_mod, y + y_mod) for _, x_mod, y_mod in self.get_legal_moves(pos, ghost_agents)}
+
+    def get_legal_actions_with_positions(self, pos: Tuple[int, int], ghost_agents: bool) -> Dict[str, Tuple[int, int]]:
+        x, y = pos
+        return {k: (x + x_mod, y + y_mod) for k, x_mod, y_mod in self.get_legal_moves(pos, ghost_agents)}
 
     def get_legal_actions(self, pos: Tuple[int, int], ghost_agents: bool) -> List[str]:
-        return list(self.get_legal_actions_with_positions(pos, ghost_agents).keys())
+        return [k for k, _, _ in self.get_legal_moves(pos, ghost_agents)]
 
     @staticmethod
     def area_positions_from_points(pos1: Tuple[int, int], pos2: Tuple[int, int]) -> List[Tuple[int, int]]:
@@ -61,51 +232,65 @@ class EvacuationGrid(MultiGrid):
         x_mod, y_mod = self.action_position_map[action]
         return x + x_mod, y + y_mod
 
+    def get_obstacles_mask(self) -> np.ndarray:
+        return self.layers[Obstacle] > 0
+
     def generate_square_rounded_map(self, start_position: Tuple[int, int],
                                     exit_positions: List[Tuple[int, int]]) -> np.array:
-        area_map = np.empty((self.width, self.height), int)
-        unmeasured_positions = set(
-            EvacuationGrid.area_positions_from_points((0, 0), (self.width - 1, self.height - 1))) - \
-                               self.positions_by_breed[Obstacle]
+        open_mask = ~self.get_obstacles_mask()
 
-        current_positions = {start_position}
-        distance = 0
+        exits_mask = np.zeros((self.width, self.height), dtype=bool)
+        for x, y in exit_positions:
+            exits_mask[x, y] = True
 
-        unreachable_positions = set()
-        av_pos_len = len(unmeasured_positions)
+        area_maps, unreachable_masks = square_rounded_maps(open_mask, [start_position], exits_mask)
+        unreachable_positions = set(map(tuple, np.argwhere(unreachable_masks[0]).tolist()))
 
-        while unmeasured_positions != set():
-            for x, y in current_positions:
-                area_map[x][y] = distance
+        return area_maps[0], unreachable_positions
 
-            next_positions = set()
 
-            if distance % 2 == 0:
-                for pos in current_positions:
-                    next_positions.update(self.get_neighborhood(pos, moore=True))
-            else:
-                for pos in current_positions:
-                    next_positions.update(self.get_neighborhood(pos, moore=False))
+class EvacuationGrid(GridLayers, MultiGrid):
 
-            unmeasured_positions -= current_positions
-            current_positions = next_positions.intersection(unmeasured_positions)
+    def __init__(self, width: int, height: int, torus: bool) -> None:
+        super().__init__(width, height, torus)
+        self.init_layers()
 
-            distance += 1
+    def place_agent(self, agent: StateAgent, pos: Tuple[int, int]) -> None:
+        super().place_agent(agent, pos)
+        self.add_to_layers(type(agent), pos)
 
-            if av_pos_len == len(
-                    unmeasured_positions):  # anti-stuck, helps in situation when some positions are unreachable
-                unreachable_positions = unmeasured_positions
-                break
-            else:
-                av_pos_len = len(unmeasured_positions)
+    def remove_agent(self, agent: StateAgent) -> None:
+        self.remove_from_layers(type(agent), agent.pos)
+        super().remove_agent(agent)
 
-        for x, y in unreachable_positions:
-            area_map[x][y] = np.amax(area_map)
+    def get_cell_index(self, agent: StateAgent) -> int:
+        x, y = agent.pos
+        return self._grid[x][y].index(agent)
 
-        for x, y in exit_positions:
-            area_map[x][y] = 0
+    def insert_agent(self, agent: StateAgent, pos: Tuple[int, int], index: int) -> None:
+        """Places agent at given index of cell list, order of agents in cell decides order of their removal at exit."""
+        x, y = pos
+        self._grid[x][y].insert(index, agent)
+        agent.pos = pos
+        if self._empties_built:
+            self._empties.discard(pos)
+
+        self.add_to_layers(type(agent), pos)
+
+    def get_neighbors_by_breed(self, pos: Tuple[int, int], breed: Type, moore: bool,
+                               include_center: bool = False) -> List[StateAgent]:
+        """Returns agents of exactly given breed around pos. Cells are looked up directly and the ones without such
+        agents are skipped using the breed layer, so cost depends only on neighborhood size."""
+        layer = self.layers[breed]
+
+        agents = []
+        for x, y in self.get_neighborhood(pos, moore, include_center):
+            if layer[x, y]:
+                agents.extend(agent for agent in self._grid[x][y] if type(agent) is breed)
 
-        for x, y in self.positions_by_breed[Obstacle]:
-            area_map[x][y] = np.amax(area_map)
+        return agents
 
-        return area_map, unreachable_positions
+    def count_uninformed_evacuees(self, pos: Tuple[int, int]) -> int:
+        """Returns number of evacuees without assigned exit around pos (Moore neighbourhood, without pos itself)."""
+        return sum(1 for evacuee in self.get_neighbors_by_breed(pos, Evacuee, moore=True)
+                   if evacuee.assigned_exit_area_id is None)
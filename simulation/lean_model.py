@@ -0,0 +1,471 @@
+import random
+from functools import partial
+from typing import Dict, List, Set, Tuple, Type
+
+import numpy as np
+
+from agents.agents import StateAgent, Sensor, Evacuee
+from agents.agents_guides import GuideQLearning
+from agents.feature_extractor import FeatureExtractor
+from simulation.grid import GridLayers
+from simulation.recording import BREEDS
+from simulation.schedule import EvacuationScheduler
+from simulation.simulation_state import SimulationState
+from simulation.world import EvacuationWorld
+
+
+class EvacueeArrays:
+    """Evacuees of lean engine as struct of arrays, row i is one evacuee. Removed evacuees stay as rows with alive
+    set to False, so rows never move. Exit -1 means no assigned exit. cells indexes rows of evacuees standing on the
+    grid by their cell, it's kept by LeanEvacuationModel.place_evacuee and lift_evacuee."""
+
+    def __init__(self, uids: List[int], positions: List[Tuple[int, int]]) -> None:
+        self.uids = np.array(uids, dtype=np.int64)
+        self.xs, self.ys = np.array(positions, dtype=np.intp).reshape(-1, 2).T.copy()
+        self.exits = np.full(len(uids), -1, dtype=np.intp)
+        self.alive = np.ones(len(uids), dtype=bool)
+        self.arrivals = np.zeros(len(uids), dtype=np.int64)  # when evacuee was placed in its cell, see LeanGrid
+        self.cells: Dict[Tuple[int, int], Set[int]] = dict()
+
+    def count(self) -> int:
+        return int(np.count_nonzero(self.alive))
+
+
+class LeanGrid(GridLayers):
+    """Grid of the lean engine, without cell lists. Agent objects (guides, sensors, exits, obstacles) keep their own
+    positions and evacuees are stored in EvacueeArrays, so grid holds only occupancy layers."""
+
+    def __init__(self, width: int, height: int) -> None:
+        self.width = width
+        self.height = height
+        self.init_layers()
+
+        # Number of evacuees without assigned exit on every cell and in total
+        self.uninformed = np.zeros((width, height), dtype=np.uint16)
+        self.uninformed_total = 0
+
+        # Counter of placements, mesa cell lists keep agents in order of arrival and exits take them in that order
+        self.arrivals = 0
+        self.agents_arrivals = dict()
+
+    def next_arrival(self) -> int:
+        self.arrivals += 1
+        return self.arrivals
+
+    def place_agent(self, agent: StateAgent, pos: Tuple[int, int]) -> None:
+        agent.pos = pos
+        self.add_to_layers(type(agent), pos)
+        self.agents_arrivals[agent.unique_id] = self.next_arrival()
+
+    def remove_agent(self, agent: StateAgent) -> None:
+        self.remove_from_layers(type(agent), agent.pos)
+        del self.agents_arrivals[agent.unique_id]
+        agent.pos = None
+
+    def move_agent(self, agent: StateAgent, pos: Tuple[int, int]) -> None:
+        self.remove_agent(agent)
+        self.place_agent(agent, pos)
+
+    def get_neighborhood(self, pos: Tuple[int, int], moore: bool,
+                         include_center: bool = False) -> List[Tuple[int, int]]:
+        """Same cells in the same order as mesa grid without torus."""
+        x, y = pos
+
+        neighborhood = []
+        for nx in range(max(0, x - 1), min(self.width, x + 2)):
+            for ny in range(max(0, y - 1), min(self.height, y + 2)):
+                if not moore and abs(nx - x) + abs(ny - y) > 1:
+                    continue
+                if not include_center and (nx, ny) == pos:
+                    continue
+
+                neighborhood.append((nx, ny))
+
+        return neighborhood
+
+    def count_uninformed_evacuees(self, pos: Tuple[int, int]) -> int:
+        x, y = pos
+        window = self.uninformed[max(0, x - 1):x + 2, max(0, y - 1):y + 2]
+        return int(window.sum()) - int(self.uninformed[x, y])
+
+
+class LeanScheduler(EvacuationScheduler):
+    """Schedule of the lean engine. Keeps agent objects like EvacuationScheduler, evacuees are activated by the model
+    all at once from its arrays."""
+
+    def step_exits(self) -> None:
+        state_ref = self.model.get_simulation_state(deep=False)
+        # Activate Exits
+        self.model.remove_agents_at_exits(state_ref)
+
+    def step_evacuees(self) -> None:
+        # Activate Evacuees by distance order
+        self.model.step_evacuees()
+
+    def get_breed_count(self, breed: Type) -> int:
+        if breed is Evacuee:
+            return self.model.evacuees.count()
+
+        return super().get_breed_count(breed)
+
+
+class LeanEvacuationModel(EvacuationWorld):
+    """Headless engine with the same constructor, step() and run_model() as EvacuationModel and the same trajectories
+    for the same seeds (see compare_engines). Evacuees are rows of NumPy arrays instead of agents on mesa grid, guides
+    are the same GuideQLearning agents. It can't be visualized, use EvacuationModel for the server."""
+
+    def __init__(self, *args, seed: int = None, **kwargs) -> None:
+        self._seed = seed
+        self.random = random.Random(seed)
+        self.running = True
+        self.current_id = 0
+        self.evacuees = EvacueeArrays([], [])
+
+        super().__init__(*args, **kwargs)
+
+        # Rank of every exit cell in exits activation order (-1 for other cells)
+        self.exit_ranks = self.grid.get_exit_ranks()
+
+    def next_id(self) -> int:
+        self.current_id += 1
+        return self.current_id
+
+    def reset_randomizer(self, seed: int = None) -> None:
+        if seed is None:
+            seed = self._seed
+        self.random.seed(seed)
+        self._seed = seed
+
+    def create_schedule(self) -> LeanScheduler:
+        return LeanScheduler(self)
+
+    def create_grid(self) -> LeanGrid:
+        return LeanGrid(self.height, self.width)
+
+    def place_evacuees(self, states: List[Tuple[int, Tuple[int, int], int]]) -> None:
+        self.evacuees = EvacueeArrays([uid for uid, _, _ in states], [pos for _, pos, _ in states])
+        self.evacuees.exits[:] = [-1 if exit_id is None else exit_id for _, _, exit_id in states]
+        for i, (_, pos, _) in enumerate(states):
+            self.place_evacuee(i, pos)
+
+    def get_arrival_ranks(self) -> Dict[int, int]:
+        ev = self.evacuees
+        alive = np.flatnonzero(ev.alive)
+        ranks = dict(zip(ev.uids[alive].tolist(), ev.arrivals[alive].tolist()))
+        ranks.update(self.grid.agents_arrivals)
+        return ranks
+
+    def set_arrival_ranks(self, ranks: Dict[int, int]) -> None:
+        ev = self.evacuees
+        ev.arrivals[:] = [ranks[uid] for uid in ev.uids.tolist()]
+        for uid in self.grid.agents_arrivals:
+            if uid in ranks:
+                self.grid.agents_arrivals[uid] = ranks[uid]
+
+        # Later arrivals have to come after all restored ones
+        self.grid.arrivals = max(ranks.values(), default=0) + 1
+
+    def init_evacuees(self, evacuees_num, available_positions):
+        if evacuees_num > len(available_positions):
+            evacuees_num = len(available_positions)
+
+        uids = []
+        positions = []
+        for _ in range(evacuees_num):
+            # same draw as random.choice, but the drawn position is removed by index instead of searched for
+            pos = available_positions.pop(random.randrange(len(available_positions)))
+
+            uids.append(self.next_id())
+            positions.append(pos)
+
+        self.evacuees = EvacueeArrays(uids, positions)
+        for i, pos in enumerate(positions):
+            self.place_evacuee(i, pos)
+
+        return set(positions)
+
+    def remove_evacuees(self) -> None:
+        for i in np.flatnonzero(self.evacuees.alive):
+            self.remove_evacuee(i)
+
+    def get_informed_positions(self) -> Tuple[np.ndarray, np.ndarray]:
+        ev = self.evacuees
+        informed = ev.alive & (ev.exits >= 0)
+        return ev.xs[informed], ev.ys[informed]
+
+    def get_evacuees_states(self) -> List[Tuple[int, Tuple[int, int], int]]:
+        ev = self.evacuees
+        alive = np.flatnonzero(ev.alive)
+        return [(uid, (x, y), None if exit_id < 0 else exit_id) for uid, x, y, exit_id in
+                zip(ev.uids[alive].tolist(), ev.xs[alive].tolist(), ev.ys[alive].tolist(), ev.exits[alive].tolist())]
+
+    def get_trajectory_columns(self) -> Tuple[np.ndarray, ...]:
+        ev = self.evacuees
+        alive = np.flatnonzero(ev.alive)
+        guides = self.schedule.get_breed_agents(GuideQLearning)
+
+        guides_positions = np.array([guide.pos for guide in guides], dtype=np.intp).reshape(-1, 2)
+        return (np.concatenate([ev.uids[alive], [guide.unique_id for guide in guides]]),
+                np.concatenate([ev.xs[alive], guides_positions[:, 0]]),
+                np.concatenate([ev.ys[alive], guides_positions[:, 1]]),
+                np.repeat([BREEDS.index(Evacuee), BREEDS.index(GuideQLearning)], [len(alive), len(guides)]),
+                np.concatenate([ev.exits[alive], np.full(len(guides), -1)]))
+
+    def place_evacuee(self, i: int, pos: Tuple[int, int]) -> None:
+        ev = self.evacuees
+        ev.xs[i], ev.ys[i] = pos
+        ev.arrivals[i] = self.grid.next_arrival()
+        ev.cells.setdefault(pos, set()).add(i)
+
+        self.grid.add_to_layers(Evacuee, pos)
+        if ev.exits[i] < 0:
+            self.grid.uninformed[pos] += 1
+            self.grid.uninformed_total += 1
+
+    def lift_evacuee(self, i: int) -> None:
+        """Takes evacuee off the grid, its row keeps the last position."""
+        ev = self.evacuees
+        pos = (int(ev.xs[i]), int(ev.ys[i]))
+        ev.cells[pos].discard(i)
+
+        self.grid.remove_from_layers(Evacuee, pos)
+        if ev.exits[i] < 0:
+            self.grid.uninformed[pos] -= 1
+            self.grid.uninformed_total -= 1
+
+    def remove_evacuee(self, i: int) -> None:
+        if self.journal is not None:
+            self.journal.append(partial(self.undo_remove_evacuee, i, int(self.evacuees.arrivals[i])))
+
+        self.lift_evacuee(i)
+        self.evacuees.alive[i] = False
+        self.world_version += 1
+
+    def undo_remove_evacuee(self, i: int, arrival: int) -> None:
+        ev = self.evacuees
+        ev.alive[i] = True
+        self.place_evacuee(i, (int(ev.xs[i]), int(ev.ys[i])))
+        ev.arrivals[i] = arrival
+
+    def move_evacuee(self, i: int, pos: Tuple[int, int]) -> None:
+        ev = self.evacuees
+        if self.journal is not None:
+            self.journal.append(partial(self.undo_move_evacuee, i, (int(ev.xs[i]), int(ev.ys[i])), int(ev.arrivals[i])))
+
+        self.lift_evacuee(i)
+        self.world_version += 1
+        self.place_evacuee(i, pos)
+
+    def undo_move_evacuee(self, i: int, pos: Tuple[int, int], arrival: int) -> None:
+        self.lift_evacuee(i)
+        self.place_evacuee(i, pos)
+        self.evacuees.arrivals[i] = arrival
+
+    def assign_exits(self, rows: np.ndarray, exit_ids) -> None:
+        """Sets exit (one for all or one for each row) of evacuees in rows, keeping uninformed counts up to date."""
+        ev = self.evacuees
+        was_uninformed = ev.exits[rows] < 0
+        ev.exits[rows] = exit_ids
+        is_uninformed = ev.exits[rows] < 0
+
+        informed = rows[was_uninformed & ~is_uninformed]
+        np.subtract.at(self.grid.uninformed, (ev.xs[informed], ev.ys[informed]), 1)
+        uninformed = rows[is_uninformed & ~was_uninformed]
+        np.add.at(self.grid.uninformed, (ev.xs[uninformed], ev.ys[uninformed]), 1)
+        self.grid.uninformed_total += len(uninformed) - len(informed)
+
+    def move_agent(self, agent: StateAgent, action: str):
+        pos = self.grid.action_to_position(agent.pos, action)
+        if self.journal is not None:
+            self.journal.append(partial(self.undo_move, agent, agent.pos, self.grid.agents_arrivals[agent.unique_id]))
+
+        self.grid.move_agent(agent, pos)
+        self.world_version += 1
+
+    def undo_move(self, agent: StateAgent, pos: Tuple[int, int], arrival: int) -> None:
+        self.grid.move_agent(agent, pos)
+        self.grid.agents_arrivals[agent.unique_id] = arrival
+
+    def remove_agent(self, agent: StateAgent, state):
+        if type(agent) == GuideQLearning:
+            experience = agent.on_remove(state)
+            self.add_guide_experience(experience)
+
+        if self.journal is not None:
+            self.journal.append(partial(self.undo_remove, agent, agent.pos, self.grid.agents_arrivals[agent.unique_id]))
+
+        self.grid.remove_agent(agent)
+        self.schedule.remove(agent)
+        self.world_version += 1
+
+    def undo_remove(self, agent: StateAgent, pos: Tuple[int, int], arrival: int) -> None:
+        self.grid.place_agent(agent, pos)
+        self.grid.agents_arrivals[agent.unique_id] = arrival
+        self.schedule.restore(agent)
+
+    def broadcast_exit_info(self, agent: StateAgent, exit_id: int, force: bool = False):
+        self.broadcast_exit_info_from(agent.pos, exit_id, force)
+
+    def broadcast_exit_info_from(self, pos: Tuple[int, int], exit_id: int, force: bool = False) -> None:
+        if not force and (self.grid.uninformed_total == 0 or self.grid.count_uninformed_evacuees(pos) == 0):
+            return
+
+        ev = self.evacuees
+        neighbors = np.array(sorted(i for cell in self.grid.get_neighborhood(pos, moore=True)
+                                    for i in ev.cells.get(cell, ())), dtype=np.intp)
+        if not force:
+            neighbors = neighbors[ev.exits[neighbors] < 0]
+
+        if self.journal is not None:
+            self.journal.append(partial(self.assign_exits, neighbors, ev.exits[neighbors].copy()))
+
+        self.assign_exits(neighbors, exit_id)
+        self.world_version += len(neighbors)
+
+    def remove_agents_at_exits(self, state: SimulationState) -> None:
+        """Removes evacuees and guides standing on exits in the order of EvacuationScheduler: by exit, then by arrival
+        to the cell. Guides learn on removal from the current state, so evacuees before them are removed first."""
+        if not self.grid.get_occupied_exits():
+            return
+
+        ev = self.evacuees
+        alive = np.flatnonzero(ev.alive)
+        ranks = self.exit_ranks[ev.xs[alive], ev.ys[alive]]
+        at_exits = alive[ranks >= 0]
+        ranks = ranks[ranks >= 0]
+
+        order = np.lexsort((ev.arrivals[at_exits], ranks))
+        evacuees_keys = list(zip(ranks[order].tolist(), ev.arrivals[at_exits][order].tolist()))
+        at_exits = at_exits[order]
+        self.count_evacuated(self.grid.exit_areas[ev.xs[at_exits], ev.ys[at_exits]])
+        at_exits = at_exits.tolist()
+
+        guides = []
+        for guide in self.schedule.get_breed_agents(GuideQLearning):
+            rank = self.exit_ranks[guide.pos]
+            if rank >= 0:
+                guides.append(((int(rank), self.grid.agents_arrivals[guide.unique_id]), guide))
+
+        removed = 0
+        for guide_key, guide in sorted(guides, key=lambda g: g[0]):
+            while removed < len(at_exits) and evacuees_keys[removed] < guide_key:
+                self.remove_evacuee(at_exits[removed])
+                removed += 1
+
+            self.remove_agent(guide, state)
+
+        for i in at_exits[removed:]:
+            self.remove_evacuee(i)
+
+    def get_evacuees_order(self) -> np.ndarray:
+        """Rows of evacuees with assigned exit, ordered by distance to the exit and then by unique id."""
+        ev = self.evacuees
+        informed = np.flatnonzero(ev.alive & (ev.exits >= 0))
+        distances = self.exit_maps_stack[ev.exits[informed], ev.xs[informed], ev.ys[informed]]
+
+        return informed[np.lexsort((ev.uids[informed], distances))]
+
+    def step_evacuees(self) -> None:
+        ev = self.evacuees
+        order = self.get_evacuees_order()
+
+        if self.evacuees_batched_moves:
+            if len(order) == 0:
+                return
+            moves = self.grid.get_best_moves(ev.xs[order], ev.ys[order], ev.exits[order], self.exit_maps_stack,
+                                             self.ghost_agents)
+            offsets = [(0, 0) if move < 0 else self.grid.moves[move][1] for move in moves.tolist()]
+        else:
+            offsets = None
+
+        for n, i in enumerate(order.tolist()):
+            x, y = int(ev.xs[i]), int(ev.ys[i])
+            exit_id = int(ev.exits[i])
+
+            if offsets is not None:
+                x_mod, y_mod = offsets[n]
+            else:
+                x_mod, y_mod = self.get_best_move((x, y), exit_id)
+
+            pos = (x + x_mod, y + y_mod)
+            self.move_evacuee(i, pos)
+            if self.evacuees_share_information:
+                self.broadcast_exit_info_from(pos, exit_id)
+
+    def get_best_move(self, pos: Tuple[int, int], exit_id: int) -> Tuple[int, int]:
+        """Same choice as Evacuee.step, returns (x_mod, y_mod) of the first of the closest legal moves."""
+        x, y = pos
+        area_map = self.exit_maps[exit_id]
+
+        best_move = (0, 0)
+        best_distance = None
+        for _, x_mod, y_mod in self.grid.get_legal_moves(pos, self.ghost_agents):
+            distance = area_map[x + x_mod, y + y_mod]
+
+            if best_distance is None or distance < best_distance:
+                best_move = (x_mod, y_mod)
+                best_distance = distance
+
+        return best_move
+
+
+def get_engine_snapshot(model: EvacuationWorld) -> Tuple:
+    guides = sorted((guide.unique_id, guide.pos) for guide in model.schedule.get_breed_agents(GuideQLearning))
+    sensors = [sensor.evacuees_in_area for sensor in model.schedule.get_breed_agents(Sensor)]
+
+    return model.schedule.steps, model.get_evacuees_states(), guides, sensors, model.evacuated_by_exit.tolist()
+
+
+def run_engine(model_class: Type[EvacuationWorld], model_params: Dict, seed: int, max_steps: int) -> Tuple[List, Dict]:
+    random.seed(seed)
+    np.random.seed(seed)
+    FeatureExtractor.informed_evacuees = 0
+
+    model = model_class(**model_params)
+    model.reset_randomizer(seed)
+
+    trajectory = [get_engine_snapshot(model)]
+    while model.running and model.schedule.steps < max_steps:
+        model.step()
+        trajectory.append(get_engine_snapshot(model))
+
+    return trajectory, model.qlearning_params
+
+
+def compare_engines(model_params: Dict, seeds: List[int], max_steps: int = 1000) -> None:
+    """Trajectory equivalence check of lean and mesa engines. Runs both with every seed and raises AssertionError at
+    the first step, where evacuees, guides or sensors differ, or if learned weights differ."""
+    from simulation.model import EvacuationModel
+
+    for seed in seeds:
+        mesa_trajectory, mesa_qlearning_params = run_engine(EvacuationModel, model_params, seed, max_steps)
+        lean_trajectory, lean_qlearning_params = run_engine(LeanEvacuationModel, model_params, seed, max_steps)
+
+        for mesa_snapshot, lean_snapshot in zip(mesa_trajectory, lean_trajectory):
+            if mesa_snapshot != lean_snapshot:
+                raise AssertionError(f"Engines differ for seed {seed} at step {mesa_snapshot[0]}")
+
+        if len(mesa_trajectory) != len(lean_trajectory):
+            raise AssertionError(f"Engines differ for seed {seed}, simulations have {len(mesa_trajectory)} and "
+                                 f"{len(lean_trajectory)} steps")
+
+        mesa_weights = None if mesa_qlearning_params is None else mesa_qlearning_params['weights']
+        lean_weights = None if lean_qlearning_params is None else lean_qlearning_params['weights']
+        if not np.array_equal(mesa_weights, lean_weights):
+            raise AssertionError(f"Engines differ for seed {seed}, learned weights {mesa_weights} and {lean_weights}")
+
+
+if __name__ == '__main__':
+    check_params = {"width": 40, "height": 40, "ghost_agents": False, "show_map": False, "guides_num": 2,
+                    "guides_mode": "Q Learning", "guides_random_position": False, "evacuees_num": 150,
+                    "evacuees_share_information": True, "evacuees_batched_moves": False, "map_type": 'default',
+                    "cross_gap": 5, "boxes_thickness": 3, "rectangles_num": 6, "rectangles_max_size": 6,
+                    "erosion_proba": 0.3, "extractor_maps": None,
+                    "qlearning_params": {'epsilon': 0.5, 'gamma': 0.8, 'alpha': 0.2, 'weights': None}}
+
+    for map_type in ['default', 'cross', 'boxes', 'random_rectangles']:
+        for ghost_agents in [False, True]:
+            for batched_moves in [False, True]:
+                compare_engines(dict(check_params, map_type=map_type, ghost_agents=ghost_agents,
+                                     evacuees_batched_moves=batched_moves), seeds=[0, 1, 2])
+                print(f"{map_type}, ghost agents: {ghost_agents}, batched moves: {batched_moves} - same trajectories")
@@ -0,0 +1,60 @@
+from typing import Dict, List
+
+import numpy as np
+
+
+class MetricsBuffer:
+    """Metrics of one episode, one value of every column per step. Columns are rows of a preallocated float array (each
+    one contiguous), which doubles its capacity when full, so appending a step doesn't allocate. Missing values (e.g.
+    lifepoints of removed guide) are NaN."""
+
+    def __init__(self, columns: List[str], capacity: int = 1024) -> None:
+        self.columns = list(columns)
+        self.indices = {name: i for i, name in enumerate(self.columns)}
+        self.data = np.full((len(self.columns), capacity), np.nan)
+        self.size = 0
+
+    @classmethod
+    def from_array(cls, columns: List[str], data: np.ndarray) -> 'MetricsBuffer':
+        buffer = cls(columns, capacity=max(1024, data.shape[1]))
+        buffer.data[:, :data.shape[1]] = data
+        buffer.size = data.shape[1]
+        return buffer
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, values: np.ndarray) -> None:
+        if self.size == self.data.shape[1]:
+            data = np.full((len(self.columns), 2 * self.size), np.nan)
+            data[:, :self.size] = self.data
+            self.data = data
+
+        self.data[:, self.size] = values
+        self.size += 1
+
+    def truncate(self, size: int) -> None:
+        """Drops steps recorded after the first size ones."""
+        self.data[:, size:self.size] = np.nan
+        self.size = size
+
+    def get(self, name: str) -> np.ndarray:
+        """Returns values of column for all recorded steps, as a view."""
+        return self.data[self.indices[name], :self.size]
+
+    def get_array(self) -> np.ndarray:
+        return self.data[:, :self.size]
+
+    @property
+    def model_vars(self) -> Dict[str, np.ndarray]:
+        # Same access as mesa DataCollector, so charts of the server can read metrics
+        return {name: self.get(name) for name in self.columns}
+
+    def export_csv(self, path: str) -> None:
+        np.savetxt(path, self.get_array().T, delimiter=",", header=",".join(self.columns), comments="", fmt="%.10g")
+
+    def export_parquet(self, path: str) -> None:
+        """Needs pandas with pyarrow or fastparquet installed."""
+        import pandas as pd
+
+        pd.DataFrame(self.get_array().T, columns=self.columns).to_parquet(path)
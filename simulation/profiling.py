@@ -0,0 +1,131 @@
+import json
+from collections import defaultdict, deque
+from functools import wraps
+from time import perf_counter
+from typing import Dict, List, Callable
+
+from agents.agents_guides import GuideQLearning
+
+# Phases of EvacuationScheduler.step: (scheduler method, phase name)
+SCHEDULER_PHASES = (('step_exits', 'exits'), ('step_sensors', 'sensors'), ('step_evacuees', 'evacuees'),
+                    ('step_guides', 'guides'))
+
+MAX_RECORDS = 10000  # steps kept in memory, older ones are only in the streamed file
+
+# Methods, which are only counted
+GRID_COUNTERS = ('get_legal_moves', 'get_legal_actions', 'get_legal_positions')
+MODEL_COUNTERS = ('move_agent', 'remove_agent', 'broadcast_exit_info')
+
+
+class StepProfiler:
+    """Time of simulation phases and number of calls of the hot methods, recorded for every step. Profiled methods are
+    wrapped on instances of the model, its schedule, grid and guides by attach(), so models without profiler run
+    unchanged code. Phase time is exclusive: time spent in another profiled phase called from it is counted only there,
+    so phases of a step add up to its "total". Phase "step" is the rest of model step (terminal conditions, data)."""
+
+    def __init__(self, path: str = None, max_records: int = MAX_RECORDS) -> None:
+        self.records = deque(maxlen=max_records)  # one record per step (the latest ones), see end_step
+        self.episode = -1
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.nested = 0.0  # time of profiled calls finished inside of the running one
+
+        # Records are also streamed as JSON lines, if path is given
+        self.file = None if path is None else open(path, "a", buffering=1)
+
+    def attach(self, model) -> None:
+        """Has to be called at the beginning of every episode, guides of the episode are new agents."""
+        self.episode += 1
+
+        if 'step' not in vars(model):
+            step = self.timed(model.step, 'step')
+
+            @wraps(step)
+            def recorded_step(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    return step(*args, **kwargs)
+                finally:
+                    self.end_step(model.schedule.steps, perf_counter() - start)
+
+            model.step = recorded_step
+
+        for name, phase in SCHEDULER_PHASES:
+            self.wrap(model.schedule, name, phase)
+        for name in MODEL_COUNTERS:
+            self.wrap_counter(model, name)
+        for name in GRID_COUNTERS:
+            self.wrap_counter(model.grid, name)
+
+        for guide in model.schedule.get_breed_agents(GuideQLearning):
+            self.wrap(guide, 'step', 'guides_action')
+            self.wrap(guide, 'update', 'guides_update')
+            self.wrap(guide.extractor, 'get_features', 'guides_features')
+            self.wrap_counter(guide.extractor, 'compute_features')  # get_features calls, which missed the cache
+
+    def wrap(self, obj, name: str, phase: str) -> None:
+        if name not in vars(obj):
+            setattr(obj, name, self.timed(getattr(obj, name), phase))
+
+    def wrap_counter(self, obj, name: str) -> None:
+        if name not in vars(obj):
+            setattr(obj, name, self.counted(getattr(obj, name), name))
+
+    def timed(self, function: Callable, phase: str) -> Callable:
+        times, calls = self.times, self.calls
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            calls[phase] += 1
+            outer_nested = self.nested
+            self.nested = 0.0
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                times[phase] += elapsed - self.nested
+                self.nested = outer_nested + elapsed
+
+        return wrapper
+
+    def counted(self, function: Callable, name: str) -> Callable:
+        calls = self.calls
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            calls[name] += 1
+            return function(*args, **kwargs)
+
+        return wrapper
+
+    def end_step(self, step: int, total: float) -> None:
+        record = {"episode": self.episode, "step": step, "total": total, "times": dict(self.times),
+                  "calls": dict(self.calls)}
+        self.records.append(record)
+        self.times.clear()
+        self.calls.clear()
+        self.nested = 0.0
+
+        if self.file is not None:
+            self.file.write(json.dumps(record) + "\n")
+
+    def get_totals(self, records: List[Dict] = None) -> Dict:
+        """Sums times and calls of records (by default all kept in memory)."""
+        if records is None:
+            records = self.records
+
+        times, calls = defaultdict(float), defaultdict(int)
+        for record in records:
+            for k, v in record["times"].items():
+                times[k] += v
+            for k, v in record["calls"].items():
+                calls[k] += v
+
+        return {"steps": len(records), "total": sum(record["total"] for record in records), "times": dict(times),
+                "calls": dict(calls)}
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
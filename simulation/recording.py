@@ -0,0 +1,146 @@
+import json
+import os
+from bisect import bisect_right
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from agents.agents import Evacuee
+from agents.agents_guides import GuideQLearning
+
+RECORDING_VERSION = 1
+BREEDS = (Evacuee, GuideQLearning)  # breed column is index into this tuple
+
+# Column name: dtype, rows of one step are agents standing on the grid after it
+COLUMNS = {"uid": np.int64, "x": np.int16, "y": np.int16, "breed": np.int8, "exit": np.int8}
+
+
+class TrajectoryRecorder:
+    """Streams position, breed and assigned exit (-1 for none) of every evacuee and guide after each step to directory
+    as columnar segments: one .npy file per column and segment, plus row offsets of its steps. Steps are buffered until
+    they have chunk_rows rows, so memory stays bounded for any number of agents and steps. index.json lists finished
+    segments and is rewritten after each of them, so a recording can be read while it grows, see TrajectoryReader."""
+
+    def __init__(self, directory: str, chunk_rows: int = 2 ** 20) -> None:
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        os.makedirs(directory, exist_ok=True)
+
+        # Recording in existing directory continues after its episodes, like profiler appends to its file
+        self.index = {"version": RECORDING_VERSION, "columns": list(COLUMNS),
+                      "breeds": [breed.__name__ for breed in BREEDS], "segments": []}
+        index_path = os.path.join(directory, "index.json")
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self.index = json.load(f)
+        self.episode = max((segment["episode"] for segment in self.index["segments"]), default=-1)
+
+        self.buffer = {name: [] for name in COLUMNS}
+        self.offsets = [0]
+        self.first_step = None
+        self.last_step = None
+
+    def attach(self, model) -> None:
+        """Starts new episode, has to be called when the model starts it (or loads a checkpoint), records its state."""
+        self.flush()
+        self.episode += 1
+        self.record(model)
+
+    def record(self, model) -> None:
+        step = model.schedule.steps
+        if self.first_step is None:
+            self.first_step = step
+        elif step != self.last_step + 1:  # steps of one segment are consecutive
+            self.flush()
+            self.first_step = step
+        self.last_step = step
+
+        for name, column in zip(COLUMNS, model.get_trajectory_columns()):
+            self.buffer[name].append(column.astype(COLUMNS[name], copy=False))
+        self.offsets.append(self.offsets[-1] + len(self.buffer["uid"][-1]))
+
+        if self.offsets[-1] >= self.chunk_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes buffered steps as a new segment, called automatically, and at the end of run_model."""
+        if self.first_step is None:
+            return
+
+        name = f"segment_{len(self.index['segments']):05d}"
+        for column, chunks in self.buffer.items():
+            np.save(os.path.join(self.directory, f"{name}_{column}.npy"),
+                    np.concatenate(chunks) if chunks else np.empty(0, dtype=COLUMNS[column]))
+        np.save(os.path.join(self.directory, f"{name}_offsets.npy"), np.array(self.offsets, dtype=np.int64))
+
+        self.index["segments"].append({"name": name, "episode": self.episode, "first_step": self.first_step,
+                                       "steps": len(self.offsets) - 1})
+        index_path = os.path.join(self.directory, "index.json")
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(self.index, f)
+        os.replace(index_path + ".tmp", index_path)
+
+        self.buffer = {name: [] for name in COLUMNS}
+        self.offsets = [0]
+        self.first_step = None
+        self.last_step = None
+
+    def close(self) -> None:
+        self.flush()
+
+
+class TrajectoryReader:
+    """Reads directory written by TrajectoryRecorder. Segments are memory-mapped when a step in them is requested, so
+    seeking to any step reads only rows of that step."""
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        with open(os.path.join(directory, "index.json")) as f:
+            self.index = json.load(f)
+        if self.index["version"] != RECORDING_VERSION:
+            raise ValueError(f"Recording version {self.index['version']} is not supported, "
+                             f"expected {RECORDING_VERSION}")
+
+        self.breeds = self.index["breeds"]
+        self.episodes = dict()  # episode: (first steps, segments), segments ordered by first step
+        for segment in self.index["segments"]:
+            first_steps, segments = self.episodes.setdefault(segment["episode"], ([], []))
+            first_steps.append(segment["first_step"])
+            segments.append(segment)
+        self.mapped = dict()
+
+    def get_episodes(self) -> List[int]:
+        return sorted(self.episodes)
+
+    def get_steps(self, episode: int = 0) -> List[int]:
+        _, segments = self.episodes[episode]
+        return [step for segment in segments
+                for step in range(segment["first_step"], segment["first_step"] + segment["steps"])]
+
+    def get_segment(self, segment: Dict) -> Dict[str, np.ndarray]:
+        name = segment["name"]
+        if name not in self.mapped:
+            self.mapped[name] = {column: np.load(os.path.join(self.directory, f"{name}_{column}.npy"), mmap_mode='r')
+                                 for column in self.index["columns"] + ["offsets"]}
+
+        return self.mapped[name]
+
+    def get_step(self, step: int, episode: int = 0) -> Dict[str, np.ndarray]:
+        """Returns columns of agents after given step (step 0 is the initial state), as read only arrays."""
+        first_steps, segments = self.episodes[episode]
+        i = bisect_right(first_steps, step) - 1
+        if i < 0 or step >= first_steps[i] + segments[i]["steps"]:
+            raise KeyError(f"Step {step} of episode {episode} was not recorded")
+
+        columns = self.get_segment(segments[i])
+        start, end = columns["offsets"][step - first_steps[i]:step - first_steps[i] + 2]
+        return {column: columns[column][start:end] for column in self.index["columns"]}
+
+    def get_positions(self, step: int, episode: int = 0, breed: str = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns xs and ys of agents (optionally only of breed given by name) after given step."""
+        columns = self.get_step(step, episode)
+        if breed is None:
+            return np.asarray(columns["x"]), np.asarray(columns["y"])
+
+        mask = columns["breed"] == self.breeds.index(breed)
+        return columns["x"][mask], columns["y"][mask]
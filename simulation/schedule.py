@@ -1,19 +1,65 @@
 from collections import defaultdict
 from copy import deepcopy
+from functools import partial
 from typing import List, Type
 
+import numpy as np
 from mesa.time import BaseScheduler
 
-from agents.agents import StateAgent, GuideAgent, Exit, Sensor, Evacuee
+from agents.agents import StateAgent, GuideAgent, Sensor, Evacuee
 from agents.agents_guides import GuideQLearning
 from simulation.simulation_state import SimulationState
 
 
+class DistanceBucketQueue:
+    """Bucket priority queue of agent ids keyed by small integer distance. Keys are updated in place when agents move,
+    so the order does not have to be rebuilt and sorted every step."""
+
+    def __init__(self):
+        self.buckets = defaultdict(dict)  # distance: {uid: None}, dict used as ordered set
+        self.keys = dict()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def update(self, uid: int, key: int) -> None:
+        old_key = self.keys.get(uid)
+        if old_key == key:
+            return
+
+        if old_key is not None:
+            self.discard(uid)
+
+        self.buckets[key][uid] = None
+        self.keys[uid] = key
+
+    def discard(self, uid: int) -> None:
+        key = self.keys.pop(uid, None)
+        if key is None:
+            return
+
+        bucket = self.buckets[key]
+        del bucket[uid]
+        if not bucket:
+            del self.buckets[key]
+
+    def ordered(self) -> List[int]:
+        # Ties are ordered by uid, which is the order of agents_by_breed, same as stable sort of all agents by distance
+        order = []
+        for key in sorted(self.buckets):
+            order.extend(sorted(self.buckets[key]))
+
+        return order
+
+
 class EvacuationScheduler(BaseScheduler):
+    # Keep evacuees ordered incrementally, False rebuilds and sorts the order every step
+    bucket_order = True
 
     def __init__(self, model):
         super().__init__(model)
         self.agents_by_breed = defaultdict(dict)
+        self.evacuees_order = DistanceBucketQueue()
 
     def add(self, agent: StateAgent) -> None:
 
@@ -28,6 +74,33 @@ class EvacuationScheduler(BaseScheduler):
 
         del self.agents_by_breed[agent_class][agent.unique_id]
 
+        if agent_class is Evacuee:
+            self.evacuees_order.discard(agent.unique_id)
+
+    def restore(self, agent: StateAgent) -> None:
+        """Adds back removed agent, keeping agents in order of unique ids as they were added."""
+        self.add(agent)
+
+        breed_agents = self.agents_by_breed[type(agent)]
+        if any(uid > agent.unique_id for uid in breed_agents):
+            self.agents_by_breed[type(agent)] = dict(sorted(breed_agents.items()))
+            self._agents = dict(sorted(self._agents.items()))
+
+        if type(agent) is Evacuee:
+            self.update_evacuee_order(agent)
+
+    def update_evacuee_order(self, evacuee: Evacuee) -> None:
+        """Has to be called after evacuee moved or its exit assignment changed."""
+        if not self.bucket_order:
+            return
+
+        exit_id = evacuee.assigned_exit_area_id
+        if exit_id is None:
+            self.evacuees_order.discard(evacuee.unique_id)
+        else:
+            x, y = evacuee.pos
+            self.evacuees_order.update(evacuee.unique_id, int(self.model.exit_maps[exit_id][x, y]))
+
     def step(self, by_breed: bool = True) -> None:
         if not by_breed:
             super().step()
@@ -35,41 +108,67 @@ class EvacuationScheduler(BaseScheduler):
             self.steps += 1
             self.time += 1
 
+        self.step_exits()
+        self.step_sensors()
+        self.step_evacuees()
+        self.step_guides()
+
+        # Steps made inside of lookahead are not recorded
+        if self.model.recorder is not None and self.model.journal is None:
+            self.model.recorder.record(self.model)
+
+    def step_exits(self) -> None:
         state_ref = self.model.get_simulation_state(deep=False)
-        # Activate Exits
-        for exit_obj in self.get_breed_agents(Exit):
-            agents_at_exit = self.model.grid.get_cell_list_contents(exit_obj.pos)
-            agents_at_exit.remove(exit_obj)
+        # Activate Exits, only the ones with evacuees or guides on them
+        grid = self.model.grid
+        for pos in grid.get_occupied_exits():
+            agents_at_exit = [agent for agent in grid.get_cell_list_contents(pos)
+                              if isinstance(agent, (Evacuee, GuideAgent))]
 
             for agent in agents_at_exit:
+                if type(agent) is Evacuee:
+                    self.model.count_evacuated([grid.exit_areas[pos]])
                 self.model.remove_agent(agent, state_ref)
 
+    def step_sensors(self) -> None:
         state_ref = self.model.get_simulation_state(deep=False)
         # Activate Sensors
+        journal = self.model.journal
         for sensor in self.get_breed_agents(Sensor):
+            if journal is not None:
+                journal.append(partial(setattr, sensor, 'evacuees_in_area', sensor.evacuees_in_area))
             sensor.step(state_ref)
 
+    def step_evacuees(self) -> None:
+        state_ref = self.model.get_simulation_state(deep=False)
         # Activate Evacuees by distance order
         # Determine order
-        index_order = dict()
-        for evacuee in self.get_breed_agents(Evacuee):
-            uid = evacuee.unique_id
-            exit_id = evacuee.assigned_exit_area_id
-            x, y = evacuee.pos
+        if self.bucket_order:
+            order_id = self.evacuees_order.ordered()
+        else:
+            index_order = dict()
+            for evacuee in self.get_breed_agents(Evacuee):
+                uid = evacuee.unique_id
+                exit_id = evacuee.assigned_exit_area_id
+                x, y = evacuee.pos
 
-            if exit_id is not None:
-                index_order.update({uid: self.model.exit_maps[exit_id][x][y]})
+                if exit_id is not None:
+                    index_order.update({uid: self.model.exit_maps[exit_id][x][y]})
 
-        order_id = sorted(index_order, key=index_order.get)
+            order_id = sorted(index_order, key=index_order.get)
 
         # Activate agents
-        for uid in order_id:
-            evacuee = self.agents_by_breed[Evacuee][uid]
-            action = evacuee.step(state_ref)
-            self.model.move_agent(evacuee, action)
-            if self.model.evacuees_share_information:
-                self.model.broadcast_exit_info(evacuee, evacuee.assigned_exit_area_id)
-
+        if self.model.evacuees_batched_moves:
+            self.step_evacuees_batched(order_id, state_ref)
+        else:
+            for uid in order_id:
+                evacuee = self.agents_by_breed[Evacuee][uid]
+                action = evacuee.step(state_ref)
+                self.model.move_agent(evacuee, action)
+                if self.model.evacuees_share_information:
+                    self.model.broadcast_exit_info(evacuee, evacuee.assigned_exit_area_id)
+
+    def step_guides(self) -> None:
         state_ref = self.model.get_simulation_state(deep=False)
         # Activate Guides
         for guide in self.get_breed_agents(GuideQLearning):
@@ -88,6 +187,23 @@ class EvacuationScheduler(BaseScheduler):
             reward = guide.get_reward(feats, feats_next)
             guide.update(feats, state_ref, reward)
 
+    def step_evacuees_batched(self, order_id: List[int], state: SimulationState) -> None:
+        """Moves all evacuees from order_id at once, their moves are computed in one vectorized pass over the grid.
+        Conflicts over target cells are resolved in order_id order."""
+        evacuees = [self.agents_by_breed[Evacuee][uid] for uid in order_id]
+        if not evacuees:
+            return
+
+        xs, ys = np.array([evacuee.pos for evacuee in evacuees]).T
+        exit_ids = np.array([evacuee.assigned_exit_area_id for evacuee in evacuees])
+        best_moves = state.grid.get_best_moves(xs, ys, exit_ids, self.model.exit_maps_stack, state.ghost_agents)
+
+        for evacuee, move in zip(evacuees, best_moves):
+            action = "MM" if move < 0 else state.grid.moves[move][0]
+            self.model.move_agent(evacuee, action)
+            if self.model.evacuees_share_information:
+                self.model.broadcast_exit_info(evacuee, evacuee.assigned_exit_area_id)
+
     def step_breed(self, breed: Type, state: SimulationState, index_order: List[int] = None) -> None:
         if index_order is None:
             agent_keys = list(self.agents_by_breed[breed].keys())
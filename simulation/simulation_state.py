@@ -2,6 +2,8 @@ from copy import copy
 
 
 class SimulationState:
+    """View of the simulation given to agents. Model keeps one view for its whole life, it always shows the current
+    world (see EvacuationWorld.get_simulation_state)."""
 
     def __init__(self, grid, schedule, exit_maps, args):
         self.grid = grid
@@ -9,3 +11,8 @@ class SimulationState:
         self.exit_maps = exit_maps
 
         self.__dict__.update(args)
+
+    @property
+    def world_version(self) -> int:
+        # read live from model, state objects are kept while agents are moving
+        return self.schedule.model.world_version
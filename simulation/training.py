@@ -0,0 +1,129 @@
+import random
+from copy import deepcopy
+from typing import Dict, List, Tuple, Callable, Type
+
+import multiprocess
+import numpy as np
+
+from agents.feature_extractor import FeatureExtractor, get_n_jobs
+from simulation.model import EvacuationModel
+from simulation.world import EvacuationWorld
+
+
+def merge_weights_sequential(weights: List[np.ndarray]) -> np.ndarray:
+    """Averages weights one by one in episodes order, the same way EvacuationModel.add_guide_experience does."""
+    merged = weights[0].copy()
+    for w in weights[1:]:
+        merged = (merged + w) / 2
+
+    return merged
+
+
+def merge_weights_mean(weights: List[np.ndarray]) -> np.ndarray:
+    return np.mean(weights, axis=0)
+
+
+MERGE_RULES = {'sequential': merge_weights_sequential, 'mean': merge_weights_mean}
+
+
+def get_epsilon_schedule(epsilon: float, epsilon_min: float, n_games: int) -> List[float]:
+    """Returns epsilon of every game and the one left after the last game. It's decreased linearly after each game as
+    long as it's not below epsilon_min."""
+    epsilon_diff = (epsilon - epsilon_min) / n_games
+
+    schedule = [epsilon]
+    for _ in range(n_games):
+        if epsilon >= epsilon_min:
+            epsilon -= epsilon_diff
+        schedule.append(epsilon)
+
+    return schedule
+
+
+worker_model = None  # model of the last episode run in this process, its world is reused by the next episodes
+
+
+def init_worker(lazy_maps: bool = False) -> None:
+    EvacuationWorld.maps_n_jobs = 1  # daemonic pool workers can't start their own pools
+    EvacuationWorld.lazy_maps = lazy_maps
+
+
+def start_episode(model: EvacuationWorld, model_params: Dict,
+                  model_class: Type[EvacuationWorld] = EvacuationModel) -> EvacuationWorld:
+    """Returns model ready for new episode. World of the previous episode model is reused with reset(), unless the map
+    is generated randomly for every episode."""
+    if model is None or model.map_type == 'random_rectangles' or type(model) is not model_class:
+        return model_class(**model_params)
+
+    model.reset(model_params['qlearning_params'])
+    return model
+
+
+def run_episode(model_params: Dict, seed: int,
+                model_class: Type[EvacuationWorld] = EvacuationModel) -> Tuple[int, Dict]:
+    """Runs one simulation with all random generators seeded, so it gives the same result in every process. Returns
+    number of steps and Q Learning parameters gathered from guides (None if no guide was removed)."""
+    global worker_model
+
+    random.seed(seed)
+    np.random.seed(seed)
+    FeatureExtractor.informed_evacuees = 0
+
+    model = worker_model = start_episode(worker_model, model_params, model_class)
+    model.reset_randomizer(seed)
+    model.run_model()
+
+    return model.schedule.steps, model.qlearning_params
+
+
+def train_parallel(model_params: Dict, n_games: int, epsilon_min: float, n_jobs: int = -1,
+                   episodes_per_round: int = None, seed: int = 0, merge_rule: str = 'sequential',
+                   on_episode: Callable[[int, int, Dict], None] = None,
+                   model_class: Type[EvacuationWorld] = EvacuationModel) -> Dict:
+    """Trains Q Learning guides running episodes in process pool. Every round runs episodes_per_round games (by default
+    one per process) from the same weights snapshot, then their weights are merged with one of MERGE_RULES. Game i
+    uses epsilon from the same schedule as sequential training and seed + i as random seed, so the same arguments
+    always give the same weights. Episodes run on model_class engine. Returns Q Learning parameters after the last
+    round."""
+    n_jobs = get_n_jobs(n_jobs)
+    if episodes_per_round is None:
+        episodes_per_round = n_jobs
+
+    merge = MERGE_RULES[merge_rule]
+    model_params = deepcopy(model_params)
+    model_params['extractor_maps'] = None  # maps are loaded in workers, from cache file shared by all of them
+    qlearning_params = model_params['qlearning_params']
+    epsilons = get_epsilon_schedule(qlearning_params['epsilon'], epsilon_min, n_games)
+
+    # Every game of random layout has new map, its maps are computed lazily in memory instead of cached to files
+    random_layout = model_params['map_type'] == 'random_rectangles'
+    if not random_layout:
+        # Map of the first game is computed here with all processes and cached, workers only load it
+        random.seed(seed)
+        model_class(**model_params)
+
+    with multiprocess.Pool(n_jobs, initializer=init_worker, initargs=(random_layout,)) as pool:
+        for round_start in range(0, n_games, episodes_per_round):
+            games = range(round_start, min(round_start + episodes_per_round, n_games))
+
+            tasks = []
+            for i in games:
+                episode_params = dict(model_params, qlearning_params=dict(qlearning_params, epsilon=epsilons[i]))
+                tasks.append((episode_params, seed + i, model_class))
+
+            results = pool.starmap(run_episode, tasks, chunksize=1)
+
+            weights = []
+            for i, (steps, episode_qlearning_params) in zip(games, results):
+                if on_episode is not None:
+                    on_episode(i, steps, episode_qlearning_params)
+                if episode_qlearning_params is not None:
+                    weights.append(episode_qlearning_params['weights'])
+
+            if weights:
+                qlearning_params = dict(qlearning_params, weights=merge(weights))
+
+        pool.close()
+        pool.join()
+
+    return dict(qlearning_params, epsilon=epsilons[-1])
@@ -0,0 +1,578 @@
+import random
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from contextlib import contextmanager
+from copy import deepcopy
+from functools import partial
+from statistics import median
+from typing import Dict, List, Tuple, Iterator
+
+import numpy as np
+
+from agents.agents import Obstacle, Exit, Sensor, StateAgent, GuideAgent, Evacuee
+from agents.agents_guides import GuideQLearning, weights_from_dict
+from agents.feature_extractor import FeatureExtractor, LazyDistanceMaps, get_feature_extractor_maps, \
+    get_landmark_distances, get_unvisited_index
+from simulation.checkpoint import save_checkpoint, load_checkpoint
+from simulation.grid import GridLayers
+from simulation.metrics import MetricsBuffer
+from simulation.profiling import StepProfiler
+from simulation.recording import TrajectoryRecorder, BREEDS
+from simulation.simulation_state import SimulationState
+
+# Variables of guides changed by their step and learning, journaled by step() inside of snapshot
+GUIDE_STEP_VARS = ('lifepoints', 'score', 'last_feats', 'last_action')
+
+
+class EvacuationWorld(ABC):
+    """Map building, episode setup and main loop shared by simulation engines. Engine provides its schedule and grid
+    (GridLayers with place_agent, move_agent and remove_agent), next_id() and the agent actions used by the schedule:
+    move_agent, remove_agent and broadcast_exit_info. Evacuees are stored by the engine, it implements the abstract
+    hooks, which access them."""
+    verbose = False
+    maps_n_jobs = -1  # processes computing feature extractor maps, has to be 1 inside of pool workers
+    # Estimate distances of feature extractor from this number of landmarks instead of all pairs maps, which need
+    # memory O(cells ** 2) and can't be built for big maps, see LandmarkDistances. 0 uses exact maps
+    distance_landmarks = 0
+    # Compute feature extractor maps on first use and keep at most lazy_maps_bytes of them, see LazyDistanceMaps
+    lazy_maps = False
+    lazy_maps_bytes = 2 ** 28
+    lazy_maps_prefetch = False  # compute maps around guides in background thread
+    profiling = False  # record time of step phases and calls of hot methods in self.profiler, see StepProfiler
+    profiling_path = None  # JSON lines file, to which profiler records are streamed
+    recording_path = None  # directory, to which agents positions are streamed after every step, see TrajectoryRecorder
+
+    def __init__(self, width: int, height: int, guides_mode: str, map_type: str, evacuees_num: int, guides_num: int,
+                 ghost_agents: bool,
+                 evacuees_share_information: bool, guides_random_position: bool, show_map: bool, rectangles_num: int,
+                 rectangles_max_size: int,
+                 erosion_proba: float, cross_gap: int, boxes_thickness: int, qlearning_params: Dict,
+                 extractor_maps: Dict, evacuees_batched_moves: bool = False):
+
+        super().__init__()
+
+        # Mapping parameters
+        self.width = width
+        self.height = height
+        self.map_type = map_type
+        self.ghost_agents = ghost_agents
+        self.guides_mode = guides_mode
+        self.evacuees_share_information = evacuees_share_information
+        self.evacuees_batched_moves = evacuees_batched_moves
+
+        # copy for sim_state purposes
+        self.evacuees_num = evacuees_num
+
+        map_params = {"rectangles_num": rectangles_num, "rectangles_max_size": rectangles_max_size,
+                      "erosion_proba": erosion_proba, "cross_gap": cross_gap,
+                      "boxes_thickness": boxes_thickness}
+
+        # CONFIG
+        self.profiler = StepProfiler(self.profiling_path) if self.profiling else None
+        self.recorder = None if self.recording_path is None else TrajectoryRecorder(self.recording_path)
+        self.schedule = self.create_schedule()
+        self.grid = self.create_grid()
+
+        self.moore = True
+        self.world_version = 0  # bumped on every agents move, removal or exit assignment
+        self.journal = None  # undo functions of changes made since the first snapshot, see snapshot()
+        self.snapshots = []  # length of journal at every open snapshot
+        self.max_route_len = (self.width * self.height) + 1
+        self.qlearning_params = None
+
+        fixed_positions = {'x_1_4': int(self.width / 4), 'x_1_2': int(self.width / 2),
+                           'x_3_4': int(self.width - (self.width / 4)),
+                           'y_1_4': int(self.height / 4), 'y_1_2': int(self.height / 2),
+                           'y_3_4': int(self.height - (self.height / 4))}
+
+        areas_centers = [(fixed_positions['x_1_4'], fixed_positions['y_3_4']),
+                         (fixed_positions['x_3_4'], fixed_positions['y_1_4']),
+                         (fixed_positions['x_1_4'], fixed_positions['y_1_4']),
+                         (fixed_positions['x_3_4'], fixed_positions['y_3_4'])]
+
+        available_positions = GridLayers.area_positions_from_points((0, 0), (self.width - 1, self.height - 1))
+
+        # EXITS
+        exit_len = 25
+        exits_areas_corners = [((0, 0), (exit_len, 0)), ((width - 1 - exit_len, height - 1), (width - 1, height - 1))]
+        exits_positions = self.init_exits(available_positions, exits_areas_corners)
+        self.grid.positions_by_breed[Exit] = exits_positions
+        self.grid.init_exit_areas(exits_positions)
+
+        # OBSTACLES
+        self.init_obstacles(available_positions, areas_centers, fixed_positions, map_params)
+        self.grid.update_open_directions()
+
+        # EXITS MAPS
+        exits_maps, unreachable_positions = self.init_exits_maps(exits_positions, show_map=show_map)
+        self.exit_maps = exits_maps
+        self.exit_maps_stack = np.stack([exits_maps[k] for k in range(len(exits_maps))])  # exit id is the first axis
+        self.closest_exit_distance = np.min([exits_maps[k] for k in range(len(exits_maps))], axis=0)
+
+        # State view given to agents, it's the same object for the whole life of the model
+        self.state = SimulationState(self.grid, self.schedule, self.exit_maps, self.get_state_params())
+
+        available_positions = list(set(available_positions) - unreachable_positions)
+
+        # SENSORS
+        self.init_sensors(available_positions, areas_centers, fixed_positions)
+
+        # FeatureExtractor INIT
+        if extractor_maps is None and self.distance_landmarks > 0:
+            extractor_maps = get_landmark_distances(self.grid, self.distance_landmarks)
+        elif extractor_maps is None and self.lazy_maps:
+            extractor_maps = LazyDistanceMaps(~self.grid.get_obstacles_mask(), self.lazy_maps_bytes,
+                                              self.lazy_maps_prefetch)
+        elif extractor_maps is None:
+            extractor_maps, FeatureExtractor.maps_lists = get_feature_extractor_maps(self.grid,
+                                                                                     n_jobs=self.maps_n_jobs)
+        self.extractor_maps = extractor_maps
+
+        # World template, everything above is kept between episodes, see reset()
+        self.guides_num = guides_num
+        self.guides_random_position = guides_random_position
+        self.areas_centers = areas_centers
+        self.available_positions = available_positions
+        self.template_current_id = self.current_id
+        self.template_qlearning_params = qlearning_params
+
+        self.init_episode(qlearning_params)
+
+    def init_episode(self, qlearning_params: Dict) -> None:
+        available_positions = list(self.available_positions)
+        self.evacuated_by_exit = np.zeros(len(self.exit_maps), dtype=int)  # evacuees removed by every exit area
+
+        # GUIDES
+        self.init_guides(self.guides_num, self.guides_random_position, available_positions, self.areas_centers,
+                         qlearning_params)
+
+        # EVACUEES
+        self.init_evacuees(self.evacuees_num, available_positions)
+
+        FeatureExtractor.maps = self.extractor_maps
+        FeatureExtractor.unvisited = get_unvisited_index(FeatureExtractor.maps, self.grid.width, self.grid.height)
+
+        self.init_metrics([guide.unique_id for guide in self.schedule.get_breed_agents(GuideQLearning)])
+        self.collect_data()
+
+        if self.profiler is not None:
+            self.profiler.attach(self)
+        if self.recorder is not None:
+            self.recorder.attach(self)
+
+    def reset(self, qlearning_params: Dict = None) -> None:
+        """Starts new episode in the same world. Obstacles, exits, exits maps, sensors and feature extractor maps are
+        reused, only guides and evacuees are placed again, drawing positions the same way constructor does. New layout
+        of 'random_rectangles' map needs new model. Q Learning parameters default to the ones given to constructor."""
+        if qlearning_params is None:
+            qlearning_params = self.template_qlearning_params
+
+        self.journal = None  # new episode can't be rolled back
+        self.snapshots = []
+        for guide in self.schedule.get_breed_agents(GuideQLearning):
+            self.grid.remove_agent(guide)
+            self.schedule.remove(guide)
+        self.remove_evacuees()
+
+        for sensor in self.schedule.get_breed_agents(Sensor):
+            sensor.evacuees_in_area = None
+
+        self.schedule.steps = 0
+        self.schedule.time = 0
+        self.current_id = self.template_current_id  # episodes get the same unique ids as in new model
+        self.running = True
+        self.world_version = 0
+        self.qlearning_params = None
+
+        self.init_episode(qlearning_params)
+
+    @abstractmethod
+    def create_schedule(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def create_grid(self) -> GridLayers:
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_evacuees(self) -> None:
+        raise NotImplementedError
+
+    def init_metrics(self, guides_uids: List[int]) -> None:
+        """Metrics recorded by collect_data after every step: evacuees left, informed and uninformed ones, informed
+        evacuees without legal move, mean distance of evacuees to the closest exit, evacuated by every exit area (total)
+        and lifepoints of every guide of the episode."""
+        self.metrics_guides = guides_uids
+        self.metrics = MetricsBuffer(["step", "evacuees", "informed", "uninformed", "stuck", "mean_exit_distance"] +
+                                     [f"evacuated_{k}" for k in range(len(self.evacuated_by_exit))] +
+                                     [f"lifepoints_{uid}" for uid in guides_uids])
+
+    def collect_data(self) -> None:
+        # Counts and distances are read from occupancy layer, only informed evacuees are gathered from the engine
+        evacuees = self.grid.layers[Evacuee]
+        count = int(evacuees.sum())
+        mean_distance = np.vdot(evacuees, self.closest_exit_distance) / count if count else np.nan
+
+        xs, ys = self.get_informed_positions()
+        open_moves, _, _ = self.grid.get_open_moves(xs, ys, self.ghost_agents)
+        guides = {guide.unique_id: guide.lifepoints for guide in self.schedule.get_breed_agents(GuideQLearning)}
+
+        self.metrics.append(np.concatenate([
+            [self.schedule.steps, count, len(xs), count - len(xs), len(xs) - np.count_nonzero(open_moves.any(axis=1)),
+             mean_distance],
+            self.evacuated_by_exit, [guides.get(uid, np.nan) for uid in self.metrics_guides]]))
+
+    @abstractmethod
+    def get_evacuees_states(self) -> List[Tuple[int, Tuple[int, int], int]]:
+        """Returns (unique id, position, assigned exit id) of every evacuee, ordered by unique id."""
+        raise NotImplementedError
+
+    def get_trajectory_columns(self) -> Tuple[np.ndarray, ...]:
+        """Returns unique ids, xs, ys, breeds (index of simulation.recording.BREEDS) and assigned exits (-1 for none)
+        of evacuees and guides."""
+        evacuees = self.get_evacuees_states()
+        guides = self.schedule.get_breed_agents(GuideQLearning)
+
+        uids = [uid for uid, _, _ in evacuees] + [guide.unique_id for guide in guides]
+        positions = np.array([pos for _, pos, _ in evacuees] + [guide.pos for guide in guides]).reshape(-1, 2)
+        breeds = [BREEDS.index(Evacuee)] * len(evacuees) + [BREEDS.index(GuideQLearning)] * len(guides)
+        exits = [-1 if exit_id is None else exit_id for _, _, exit_id in evacuees] + [-1] * len(guides)
+
+        return np.array(uids), positions[:, 0], positions[:, 1], np.array(breeds), np.array(exits)
+
+    @abstractmethod
+    def get_informed_positions(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns xs and ys of evacuees with assigned exit."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def place_evacuees(self, states: List[Tuple[int, Tuple[int, int], int]]) -> None:
+        """Places evacuees given as get_evacuees_states returns them."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_arrival_ranks(self) -> Dict[int, int]:
+        """Returns rank of every evacuee and guide, which orders agents standing on the same cell by their arrival."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_arrival_ranks(self, ranks: Dict[int, int]) -> None:
+        raise NotImplementedError
+
+    def save_checkpoint(self, path: str) -> None:
+        save_checkpoint(self, path)
+
+    def load_checkpoint(self, path: str) -> None:
+        load_checkpoint(self, path)
+
+    def run_model(self):
+        # This method is not invoked by server!
+
+        simulation_start_time = time.time()
+
+        if self.verbose:
+            print("Initial number of Evacuees: ", self.schedule.get_breed_count(Evacuee))
+            print("Initial number of Guides: ", self.schedule.get_breed_count(GuideAgent))
+
+        while self.running:
+            self.step()
+
+        if self.recorder is not None:
+            self.recorder.flush()
+
+        if self.verbose:
+            print("")
+            print("Final number of Evacuees: ", self.schedule.get_breed_count(Evacuee))
+            print("Final number of Guides: ", self.schedule.get_breed_count(GuideAgent))
+
+        return time.time() - simulation_start_time
+
+    def step(self):
+        if self.journal is not None:
+            self.journal_step()
+
+        self.schedule.step()
+        state = self.get_simulation_state()
+
+        # Terminal conditions
+        for guide in self.schedule.get_breed_agents(GuideQLearning):
+            if guide.lifepoints < 0:
+                self.remove_agent(guide, state)
+
+        if self.schedule.get_guides_count() == 0:
+            self.running = False
+
+        # Collect data
+        self.collect_data()
+
+        if self.verbose:
+            print([self.schedule.time, self.schedule.get_breed_count(Evacuee)])
+
+    def journal_step(self) -> None:
+        """Journals what step() changes besides the world: step counters, metrics, learning of guides (their variables,
+        weights and experience of removed ones), feature extractor and random generators."""
+        guides = self.schedule.get_breed_agents(GuideQLearning)
+        guides_vars = [(guide, {name: value for name, value in vars(guide).items() if name in GUIDE_STEP_VARS})
+                       for guide in guides]
+
+        # Weights are updated in place and may be shared by guides and qlearning_params
+        weights = {id(guide.weights): guide.weights for guide in guides}
+        if self.qlearning_params is not None:
+            weights[id(self.qlearning_params['weights'])] = self.qlearning_params['weights']
+
+        unvisited = deepcopy(FeatureExtractor.unvisited, {id(FeatureExtractor.maps): FeatureExtractor.maps})
+        self.journal.append(partial(self.undo_step, self.schedule.steps, self.schedule.time, self.running,
+                                    len(self.metrics), guides_vars,
+                                    [(array, array.copy()) for array in weights.values()], self.qlearning_params,
+                                    FeatureExtractor.informed_evacuees, unvisited,
+                                    (random.getstate(), self.random.getstate(), np.random.get_state())))
+
+    def undo_step(self, steps: int, time_: int, running: bool, metrics_size: int, guides_vars: List,
+                  weights: List, qlearning_params: Dict, informed_evacuees: int, unvisited, random_states) -> None:
+        self.schedule.steps = steps
+        self.schedule.time = time_
+        self.running = running
+        self.metrics.truncate(metrics_size)
+
+        for guide, guide_vars in guides_vars:
+            for name in GUIDE_STEP_VARS:
+                vars(guide).pop(name, None)
+            vars(guide).update(guide_vars)
+        for array, values in weights:
+            array[:] = values
+        self.qlearning_params = qlearning_params
+
+        FeatureExtractor.informed_evacuees = informed_evacuees
+        FeatureExtractor.unvisited = unvisited
+
+        python_random, model_random, numpy_random = random_states
+        random.setstate(python_random)
+        self.random.setstate(model_random)
+        np.random.set_state(numpy_random)
+
+    def count_evacuated(self, exit_areas: np.ndarray) -> None:
+        """Adds evacuees removed by exit areas (one area id for every evacuee) to evacuated_by_exit."""
+        np.add.at(self.evacuated_by_exit, exit_areas, 1)
+        if self.journal is not None:
+            self.journal.append(partial(np.subtract.at, self.evacuated_by_exit, exit_areas, 1))
+
+    def add_guide_experience(self, guide_vars: Dict):
+        if self.qlearning_params is None:
+            self.qlearning_params = guide_vars
+        else:
+            weights = self.qlearning_params['weights']
+            weights[:] = (weights + guide_vars['weights']) / 2
+
+    def get_simulation_state(self, deep=False):
+        """Returns the state view of the model, which always shows the current world. deep=True returns copy of the
+        grid and agents of the schedule, the model itself (with evacuee rows of the lean engine) is shared. For what-if
+        evaluation lookahead() is much cheaper."""
+        if not deep:
+            return self.state
+
+        # Schedule refers to the model, which is shared with its maps, profiler, recorder and metrics, only grid and
+        # agents are copied
+        memo = {id(obj): obj for obj in (self, self.extractor_maps, self.exit_maps, self.profiler, self.recorder)}
+        return SimulationState(deepcopy(self.grid, memo), deepcopy(self.schedule, memo), self.exit_maps,
+                               self.get_state_params())
+
+    def get_state_params(self) -> Dict:
+        params_keys = ['width', 'height', 'guides_mode', 'map_type', 'evacuees_num', 'ghost_agents',
+                       'evacuees_share_information', 'max_route_len']
+        return {k: v for k, v in vars(self).items() if k in params_keys}
+
+    def snapshot(self) -> int:
+        """Starts recording changes of the world: moves and removals of agents, exit assignments, evacuated counts and
+        sensor readings, and for every step() also step counters, metrics, learning of guides, feature extractor
+        (informed evacuees, unvisited index) and random generators. Returns snapshot, to which restore() rolls the model
+        back in time proportional to the number of changes made since, so steps made inside of a snapshot don't change
+        the later run. Snapshots can be nested."""
+        if self.journal is None:
+            self.journal = []
+
+        self.snapshots.append(len(self.journal))
+        return len(self.snapshots) - 1
+
+    def restore(self, snapshot: int) -> None:
+        """Rolls back to snapshot, snapshots taken after it are dropped."""
+        while len(self.journal) > self.snapshots[snapshot]:
+            undo = self.journal.pop()
+            undo()
+
+        del self.snapshots[snapshot:]
+        if not self.snapshots:
+            self.journal = None
+
+        # Versions are never reused, features cached during lookahead must not match any later world
+        self.world_version += 1
+
+    @contextmanager
+    def lookahead(self) -> Iterator[SimulationState]:
+        """Changes made inside of the block are rolled back at its end, e.g. to evaluate state after hypothetical
+        moves. Yields the state view of the model."""
+        snapshot = self.snapshot()
+        try:
+            yield self.state
+        finally:
+            self.restore(snapshot)
+
+    def init_obstacles(self, available_positions, areas_centers, fixed_positions, map_params):
+        obstacles_corners = []
+        obstacles_positions = set()
+
+        if self.map_type == 'default':
+            pass
+        elif self.map_type == 'cross':
+            gap_thck = map_params["cross_gap"]  # gap thickness
+            obstacles_corners = [((fixed_positions['x_1_2'], 0 + gap_thck),
+                                  (fixed_positions['x_1_2'], fixed_positions['y_1_2'] - gap_thck)),
+
+                                 ((fixed_positions['x_1_2'], self.height - 1 - gap_thck),
+                                  (fixed_positions['x_1_2'], fixed_positions['y_1_2'] + gap_thck)),
+
+                                 ((0 + gap_thck, fixed_positions['y_1_2']),
+                                  (fixed_positions['x_1_2'] - gap_thck, fixed_positions['y_1_2'])),
+
+                                 ((fixed_positions['x_1_2'] + gap_thck, fixed_positions['y_1_2']),
+                                  (self.height - gap_thck, fixed_positions['y_1_2']))]
+
+        elif self.map_type == 'boxes':
+            thck = map_params["boxes_thickness"]  # thickness
+            for x, y in areas_centers:
+                obstacles_corners.append(((x + thck, y + thck), (x - thck, y - thck)))
+
+        elif self.map_type == 'random_rectangles':
+            rectangles_num = map_params['rectangles_num']
+            rectangle_max_size = range(1, map_params['rectangles_max_size'])
+            erosion_proba = map_params['erosion_proba']
+
+            obstacles_positions = set()
+            for _ in range(rectangles_num):
+                center = random.choice(available_positions)
+
+                x_random = random.choice(rectangle_max_size)
+                max_x, min_x = center[0] + x_random, center[0] - x_random
+
+                y_random = random.choice(rectangle_max_size)
+                max_y, min_y = center[1] + y_random, center[1] - y_random
+
+                box_points = set(GridLayers.area_positions_from_points((min_x, min_y), (max_x, max_y)))
+                rectangle_points = set()
+                for x, y in box_points:
+                    if x == max_x or x == min_x or y == max_y or y == min_y:
+                        rectangle_points.add((x, y))
+
+                rectangle_points = rectangle_points.intersection(set(available_positions))
+
+                for pos in list(rectangle_points):
+                    if random.choices([True, False], weights=[erosion_proba, 1 - erosion_proba], k=1)[0]:
+                        rectangle_points.remove(pos)
+
+                obstacles_positions.update(rectangle_points)
+
+        if self.map_type == 'cross' or self.map_type == 'boxes':
+            for i, (a, b) in enumerate(obstacles_corners):
+                area_positions = GridLayers.area_positions_from_points(a, b)
+                obstacles_positions.update(area_positions)
+
+        self.grid.place_static(Obstacle, obstacles_positions)
+        available_positions[:] = [pos for pos in available_positions if pos not in obstacles_positions]
+
+        return obstacles_positions
+
+    def init_exits(self, available_positions, exits_areas_corners):
+        exits_positions = dict()
+        for area_id, exit_obj in enumerate(exits_areas_corners):
+            area = GridLayers.area_positions_from_points(exit_obj[0], exit_obj[1])
+            exits_positions.update({area_id: area})
+
+            self.grid.place_static(Exit, area)
+            area_positions = set(area)
+            available_positions[:] = [pos for pos in available_positions if pos not in area_positions]
+
+        return exits_positions
+
+    def init_exits_maps(self, exits_positions, show_map=False):
+        exits_maps = dict()
+        unreachable_positions = set()
+        for k, v in exits_positions.items():
+            start_position = (int(median([x[0] for x in v])), int(median(([x[1] for x in v]))))
+
+            area_map, unreachable_positions_part = self.grid.generate_square_rounded_map(start_position, v)
+
+            exits_maps[k] = area_map
+            unreachable_positions.update(unreachable_positions_part)
+
+        # Map test
+        if show_map:
+            self.grid.map_values = list(exits_maps.values())[1]
+
+        return exits_maps, unreachable_positions
+
+    def init_sensors(self, available_positions, areas_centers, fixed_positions):
+        sensors_positions = set()
+        for i, pos in enumerate(areas_centers):
+            sensing_area = GridLayers.area_positions_from_points(
+                (pos[0] - fixed_positions['x_1_4'], pos[1] - fixed_positions['y_1_4']),
+                (pos[0] + fixed_positions['x_1_4'], pos[1] + fixed_positions['y_1_4']))
+            sensing_area = set(available_positions).intersection(set(sensing_area))
+
+            sensor = Sensor(uid=self.next_id(), pos=pos, random_seed=self.random, sensor_area_id=i,
+                            sensing_positions=sensing_area)
+            self.grid.place_agent(sensor, pos)
+            self.grid.add_sensor(sensor)
+            self.schedule.add(sensor)
+
+            sensors_positions.add(pos)
+
+        return sensors_positions
+
+    def init_guides(self, guides_num, guides_random_position, available_positions, areas_centers, q_learning_params):
+        guides_positions = defaultdict(lambda: set())
+
+        shared_weights = None
+        if self.guides_mode == "Q Learning" and q_learning_params['weights'] is not None:
+            shared_weights = q_learning_params['weights']
+            if isinstance(shared_weights, dict):  # JSON format, converted once so guides share one vector
+                shared_weights = weights_from_dict(shared_weights)
+
+        for i in range(guides_num):
+            if guides_random_position or self.map_type == 'boxes' or self.map_type == 'random_rectangles':
+                pos = random.choice(available_positions)
+            else:
+                pos = areas_centers[i]
+
+            if self.guides_mode == "Q Learning":
+                qlearning_weights = shared_weights
+
+                epsilon = q_learning_params['epsilon']
+                gamma = q_learning_params['gamma']  # aka discount factor
+                alpha = q_learning_params['alpha']
+
+                guide = GuideQLearning(uid=self.next_id(), pos=pos, random_seed=self.random, epsilon=epsilon,
+                                       gamma=gamma, alpha=alpha, weights=qlearning_weights)
+
+            self.grid.place_agent(guide, pos)
+            self.schedule.add(guide)
+
+            available_positions.remove(pos)
+            guides_positions[type(guide)].add(pos)
+        return guides_positions
+
+    def init_evacuees(self, evacuees_num, available_positions):
+        if evacuees_num > len(available_positions):
+            evacuees_num = len(available_positions)
+
+        evacuees_positions = set()
+        for _ in range(evacuees_num):
+            # same draw as random.choice, but the drawn position is removed by index instead of searched for
+            pos = available_positions.pop(random.randrange(len(available_positions)))
+
+            evacuee = Evacuee(uid=self.next_id(), pos=pos, random_seed=self.random)
+            self.grid.place_agent(evacuee, pos)
+            self.schedule.add(evacuee)
+
+            evacuees_positions.add(pos)
+
+        return evacuees_positions
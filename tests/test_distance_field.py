@@ -0,0 +1,104 @@
+import random
+from itertools import product
+
+import numpy as np
+import pytest
+
+from agents.agents import Exit
+from simulation.distance_field import square_rounded_maps
+from simulation.model import EvacuationModel
+from simulation.world import EvacuationWorld
+
+
+def get_neighborhood(open_mask, pos, moore):
+    width, height = open_mask.shape
+    x, y = pos
+    for dx, dy in product((-1, 0, 1), repeat=2):
+        if (dx, dy) == (0, 0) or (not moore and dx != 0 and dy != 0):
+            continue
+        if 0 <= x + dx < width and 0 <= y + dy < height:
+            yield x + dx, y + dy
+
+
+def reference_square_rounded_map(open_mask, start_position, exit_positions):
+    """Set based BFS replaced by simulation.distance_field, with zero initialised map instead of np.empty one."""
+    width, height = open_mask.shape
+    area_map = np.zeros((width, height), int)
+    obstacles = {(x, y) for x, y in product(range(width), range(height)) if not open_mask[x, y]}
+    unmeasured_positions = set(product(range(width), range(height))) - obstacles
+
+    current_positions = {start_position}
+    distance = 0
+
+    unreachable_positions = set()
+    av_pos_len = len(unmeasured_positions)
+
+    while unmeasured_positions != set():
+        for x, y in current_positions:
+            area_map[x][y] = distance
+
+        next_positions = set()
+        for pos in current_positions:
+            next_positions.update(get_neighborhood(open_mask, pos, moore=distance % 2 == 0))
+
+        unmeasured_positions -= current_positions
+        current_positions = next_positions.intersection(unmeasured_positions)
+
+        distance += 1
+
+        if av_pos_len == len(unmeasured_positions):
+            unreachable_positions = unmeasured_positions
+            break
+        else:
+            av_pos_len = len(unmeasured_positions)
+
+    for x, y in unreachable_positions:
+        area_map[x][y] = np.amax(area_map)
+
+    for x, y in exit_positions:
+        area_map[x][y] = 0
+
+    for x, y in obstacles:
+        area_map[x][y] = np.amax(area_map)
+
+    return area_map, unreachable_positions
+
+
+def assert_same_maps(open_mask, start_positions, exit_positions=()):
+    exits_mask = np.zeros(open_mask.shape, dtype=bool)
+    for x, y in exit_positions:
+        exits_mask[x, y] = True
+
+    maps, unreachable = square_rounded_maps(open_mask, start_positions, exits_mask)
+    for area_map, unreachable_mask, start_position in zip(maps, unreachable, start_positions):
+        expected_map, expected_unreachable = reference_square_rounded_map(open_mask, start_position, exit_positions)
+
+        assert np.array_equal(area_map, expected_map), start_position
+        assert set(map(tuple, np.argwhere(unreachable_mask).tolist())) == expected_unreachable, start_position
+
+
+@pytest.mark.parametrize("map_type", ['default', 'cross', 'boxes', 'random_rectangles'])
+def test_square_rounded_maps_of_model_maps(monkeypatch, map_type):
+    monkeypatch.setattr(EvacuationWorld, "lazy_maps", True)  # extractor maps aren't needed, nor written to cache
+    random.seed(0)
+    model = EvacuationModel(width=30, height=30, ghost_agents=False, show_map=False, guides_num=1,
+                            guides_mode="Q Learning", guides_random_position=False, evacuees_num=10,
+                            evacuees_share_information=True, map_type=map_type, cross_gap=3, boxes_thickness=3,
+                            rectangles_num=8, rectangles_max_size=6, erosion_proba=0.3, extractor_maps=None,
+                            qlearning_params={'epsilon': 0.5, 'gamma': 0.8, 'alpha': 0.2, 'weights': None})
+    open_mask = ~model.grid.get_obstacles_mask()
+
+    open_positions = [tuple(pos) for pos in np.argwhere(open_mask).tolist()]
+    assert_same_maps(open_mask, open_positions[::7])
+
+    for exit_positions in model.grid.positions_by_breed[Exit].values():
+        assert_same_maps(open_mask, [exit_positions[len(exit_positions) // 2]], exit_positions)
+
+
+def test_square_rounded_maps_of_enclosed_area():
+    open_mask = np.ones((12, 10), dtype=bool)
+    open_mask[3:8, 2] = open_mask[3:8, 6] = False
+    open_mask[3, 2:7] = open_mask[7, 2:7] = False  # walls around area 4..6 x 3..5
+    open_mask[10, :] = False  # wall splitting the map in two
+
+    assert_same_maps(open_mask, [(0, 0), (5, 4), (11, 9), (1, 8), (4, 3)], exit_positions=[(0, 0), (1, 0)])
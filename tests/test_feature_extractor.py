@@ -0,0 +1,36 @@
+from copy import deepcopy
+
+import numpy as np
+
+from agents.feature_extractor import LazyDistanceMaps
+
+
+def test_lazy_maps_recompute_maps_of_failed_prefetch():
+    open_mask = np.ones((10, 8), dtype=bool)
+    open_mask[4, 1:] = False
+    maps = LazyDistanceMaps(open_mask, prefetch=True)
+
+    compute = maps.compute
+    failures = [MemoryError("prefetch failed")]
+
+    def compute_failing_once(positions):
+        if failures:
+            raise failures.pop()
+        return compute(positions)
+
+    maps.compute = compute_failing_once
+    maps.prefetch([(1, 1), (7, 2)])
+
+    expected = LazyDistanceMaps(open_mask)
+    assert np.array_equal(maps[(1, 1)], expected[(1, 1)])
+    assert np.array_equal(maps[(7, 2)], expected[(7, 2)])
+    assert not maps.pending
+
+    maps.prefetch([(1, 1), (0, 5)])
+    assert np.array_equal(maps[(0, 5)], expected[(0, 5)])
+    assert maps.get_stats()["prefetched"] == 1
+
+
+def test_lazy_maps_are_shared_by_deep_copies():
+    maps = LazyDistanceMaps(np.ones((5, 5), dtype=bool), prefetch=True)
+    assert deepcopy(maps) is maps
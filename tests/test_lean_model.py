@@ -0,0 +1,18 @@
+import pytest
+
+from simulation.lean_model import compare_engines
+from simulation.world import EvacuationWorld
+
+
+@pytest.mark.parametrize("map_type", ['default', 'boxes', 'random_rectangles'])
+@pytest.mark.parametrize("ghost_agents", [False, True])
+def test_engines_have_the_same_trajectories(monkeypatch, map_type, ghost_agents):
+    monkeypatch.setattr(EvacuationWorld, "lazy_maps", True)  # the same maps, without writing them to cache
+    model_params = {"width": 30, "height": 30, "ghost_agents": ghost_agents, "show_map": False, "guides_num": 2,
+                    "guides_mode": "Q Learning", "guides_random_position": False, "evacuees_num": 80,
+                    "evacuees_share_information": True, "evacuees_batched_moves": False, "map_type": map_type,
+                    "cross_gap": 3, "boxes_thickness": 3, "rectangles_num": 6, "rectangles_max_size": 6,
+                    "erosion_proba": 0.3, "extractor_maps": None,
+                    "qlearning_params": {'epsilon': 0.5, 'gamma': 0.8, 'alpha': 0.2, 'weights': None}}
+
+    compare_engines(model_params, seeds=[0, 1], max_steps=200)
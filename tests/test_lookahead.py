@@ -0,0 +1,44 @@
+import random
+
+import numpy as np
+import pytest
+
+from agents.feature_extractor import FeatureExtractor
+from simulation.lean_model import LeanEvacuationModel, get_engine_snapshot
+from simulation.model import EvacuationModel
+from simulation.world import EvacuationWorld
+
+
+def run(model_class, seed, lookahead_steps):
+    random.seed(seed)
+    np.random.seed(seed)
+    FeatureExtractor.informed_evacuees = 0
+
+    model = model_class(width=30, height=30, ghost_agents=False, show_map=False, guides_num=2,
+                        guides_mode="Q Learning", guides_random_position=False, evacuees_num=80,
+                        evacuees_share_information=True, map_type='boxes', cross_gap=3, boxes_thickness=3,
+                        rectangles_num=6, rectangles_max_size=6, erosion_proba=0.3, extractor_maps=None,
+                        qlearning_params={'epsilon': 0.5, 'gamma': 0.8, 'alpha': 0.2, 'weights': None})
+    model.reset_randomizer(seed)
+
+    trajectory = [get_engine_snapshot(model)]
+    while model.running and model.schedule.steps < 100:
+        if model.schedule.steps % 5 == 2:
+            with model.lookahead():
+                for _ in range(lookahead_steps):
+                    if model.running:
+                        model.step()
+
+        model.step()
+        trajectory.append(get_engine_snapshot(model))
+
+    weights = None if model.qlearning_params is None else model.qlearning_params['weights'].tolist()
+    return trajectory, model.metrics.get_array().tobytes(), weights, FeatureExtractor.informed_evacuees, \
+        random.random(), np.random.random_sample()
+
+
+@pytest.mark.parametrize("model_class", [EvacuationModel, LeanEvacuationModel])
+def test_steps_inside_of_lookahead_do_not_change_the_run(monkeypatch, model_class):
+    monkeypatch.setattr(EvacuationWorld, "lazy_maps", True)
+
+    assert run(model_class, 3, lookahead_steps=4) == run(model_class, 3, lookahead_steps=0)